@@ -0,0 +1,149 @@
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import xml.etree.ElementTree as ET
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+TEST_DIR = os.path.join(BENCH_DIR, "..", "test")
+SRC_DIR = os.path.join(BENCH_DIR, "..", "src")
+sys.path.insert(0, os.path.join(BENCH_DIR, "..", "scripts"))
+
+from coverage import score_coverage, merge_cdds
+
+BASELINE = os.path.join(BENCH_DIR, "baseline.json")
+LATEST = os.path.join(BENCH_DIR, "latest.json")
+
+# Must match the coverage settings in scripts/regress.py
+COVERAGE_SRCS = [f"{SRC_DIR}/Receiver_Core.v", f"{SRC_DIR}/snes_nes_rec_peripheral.v"]
+COVERAGE_TOP = "tqvp_nes_snes_controller"
+COVERAGE_HIER = "tb.test_harness.user_peripheral"
+
+def metric(value, unit, higher_is_better=True):
+    return {"value": value, "unit": unit, "higher_is_better": higher_is_better}
+
+def make(*args, **env):
+    # Run the cocotb Makefile in the test directory, returns results.xml
+    result = subprocess.run(["make", "-B", *args], cwd=TEST_DIR, env=dict(os.environ, **env),
+                            stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+    results_file = os.path.join(TEST_DIR, "results.xml")
+    if result.returncode != 0 or not os.path.exists(results_file):
+        print(result.stdout)
+        raise RuntimeError(f"make {' '.join(args)} failed")
+    return ET.parse(results_file).getroot()
+
+def bench_harness(work_dir):
+    # SPI transactions through TinyQV and NES frames through NES_Controller, from test/bench.py
+    results_file = os.path.join(work_dir, "bench.json")
+    make("MODULE=bench", BENCH_RESULTS=results_file)
+    with open(results_file) as f:
+        return json.load(f)
+
+def test_nes_sim_rate(sim):
+    # Simulated ns per wall second of the whole test. Icarus dumps waves as
+    # it does in a regression, Verilator runs without tracing.
+    root = make("MODULE=test", f"SIM={sim}", TESTCASE="test_nes")
+    testcase = next(root.iter("testcase"))
+    if testcase.find("failure") is not None or testcase.find("error") is not None:
+        raise RuntimeError(f"test_nes failed on {sim}")
+    return float(testcase.get("sim_time_ns")) / float(testcase.get("time"))
+
+def bench_test_nes():
+    icarus_rate = test_nes_sim_rate("icarus")
+    results = {"test_nes_sim_rate": metric(icarus_rate, "sim-ns/wall-s")}
+    vcd = os.path.join(TEST_DIR, "tb.vcd")
+    if shutil.which("verilator") is None:
+        print("verilator not found, skipping the Verilator benchmarks")
+        return results, vcd
+
+    verilator_rate = test_nes_sim_rate("verilator")
+    results["test_nes_verilator_sim_rate"] = metric(verilator_rate, "sim-ns/wall-s")
+    results["test_nes_verilator_speedup"] = metric(verilator_rate / icarus_rate, "x icarus")
+    print(f"test_nes: Verilator runs {verilator_rate / icarus_rate:.1f}x faster than icarus")
+    return results, vcd
+
+def bench_covered(vcd, work_dir):
+    # covered score and merge time per MB of VCD
+    if shutil.which("covered") is None:
+        print("covered not found, skipping the coverage benchmarks")
+        return {}
+    vcd_mb = os.path.getsize(vcd) / 2**20
+
+    start = time.perf_counter()
+    cdd = score_coverage(srcs=COVERAGE_SRCS, top_module=COVERAGE_TOP, hier_path=COVERAGE_HIER, vcd=vcd, seed="bench",
+                         cov_dir=work_dir, keep_vcd=True)
+    score_s = time.perf_counter() - start
+
+    copy = os.path.join(work_dir, "cov_bench_copy.cdd")
+    shutil.copy(cdd, copy)
+    start = time.perf_counter()
+    merge_cdds([cdd, copy], os.path.join(work_dir, "merged.cdd"))
+    merge_s = time.perf_counter() - start
+
+    return {
+        "covered_score": metric(score_s / vcd_mb, "s/MB of VCD", higher_is_better=False),
+        "covered_merge": metric(merge_s / vcd_mb, "s/MB of VCD", higher_is_better=False),
+    }
+
+def run_benchmarks():
+    with tempfile.TemporaryDirectory() as work_dir:
+        results = bench_harness(work_dir)
+        test_nes, vcd = bench_test_nes()
+        results.update(test_nes)
+        results.update(bench_covered(vcd, work_dir))
+    return results
+
+def compare(baseline, results, threshold):
+    # Relative change of every metric, positive is better. Returns the metrics that regressed.
+    regressed = []
+    print(f"{'metric':<28} {'baseline':>12} {'current':>12} {'change':>8}  unit")
+    for name, current in results.items():
+        base = baseline.get(name)
+        if base is None or not base["value"]:
+            print(f"{name:<28} {'':>12} {current['value']:>12.4g} {'new':>8}  {current['unit']}")
+            continue
+        change = (current["value"] - base["value"]) / base["value"]
+        if not current["higher_is_better"]:
+            change = -change
+        flag = "  REGRESSED" if change < -threshold else ""
+        print(f"{name:<28} {base['value']:>12.4g} {current['value']:>12.4g} {100 * change:>+7.1f}%  {current['unit']}{flag}")
+        if flag:
+            regressed.append(name)
+    return regressed
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the verification stack against a JSON baseline.")
+    parser.add_argument("-save", action="store_true", help="Save the results as the new baseline")
+    parser.add_argument("-baseline", default=BASELINE, help="Baseline to compare with or save to")
+    parser.add_argument("-threshold", type=float, default=0.2, help="Fail if a metric is worse by more than this fraction")
+    parser.add_argument("-results", default=None, help="Compare these saved results instead of running the benchmarks")
+    args = parser.parse_args()
+
+    if args.results:
+        with open(args.results) as f:
+            results = json.load(f)
+    else:
+        results = run_benchmarks()
+        with open(LATEST, "w") as f:
+            json.dump(results, f, indent=1, sort_keys=True)
+
+    if args.save:
+        with open(args.baseline, "w") as f:
+            json.dump(results, f, indent=1, sort_keys=True)
+        print(f"Saved baseline {args.baseline}")
+        return
+
+    if not os.path.exists(args.baseline):
+        sys.exit(f"No baseline at {args.baseline}, create one with -save")
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    regressed = compare(baseline, results, args.threshold)
+    if regressed:
+        sys.exit(f"{len(regressed)} metrics regressed by more than {100 * args.threshold:.0f}%: {', '.join(regressed)}")
+
+if __name__ == "__main__":
+    main()
@@ -1,64 +1,30 @@
 import argparse
+import re
 import subprocess
 import os
+import shutil
+import threading
+import concurrent.futures
+import multiprocessing
+from covered_report import METRICS, parse_report, run_report, uncovered_items, write_json
 
-def get_coverage(srcs, top_module, hier_path, cover_types="line,comb,toggle",vcd="tb.vcd", seed="", cov_dir="cov"):
-
-    cmd = [
-        "covered", "score", 
-    ]
-    for src in srcs:
-        cmd.extend(["-v", src])
-    
-    cmd.extend([
-        "-t", top_module,
-        "-i", hier_path,
-        "-vcd", vcd,
-        "-o", f"{cov_dir}/cov_{seed}.cdd"
-    ])
-    print(f"Getting coverage for run: {seed} command:")
-    print("Running command:", " ".join(cmd))
-    subprocess.run(cmd, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
-
-def merge_coverage(work_dir, merged_cov_file):
-
-    cdd_files = [f for f in os.listdir(work_dir) if f.endswith('.cdd')]
-    temp_stash = f"{work_dir}/temp_stash.ccd"
-
-    if merged_cov_file in cdd_files:
-       
-        src_path = os.path.join(work_dir, merged_cov_file)
-        dst_path = os.path.join(work_dir, "temp_stash.ccd")
-
-        with open(src_path, "rb") as src, open(dst_path, "wb") as dst:
-            dst.write(src.read())
-        cdd_files.remove(merged_cov_file)
-    print("Found .cdd files:", cdd_files)
-
-    cmd = [
-        "covered", "merge",
-        "-d", work_dir,
-    ]
-
-    for ccd in cdd_files:
-        cmd.extend([f"{work_dir}/{ccd}"])
-
-    if temp_stash in cdd_files:
-        cmd.extend([f"{work_dir}/temp_stash.ccd"])
-
-    cmd.extend(["-o",f"{work_dir}/{merged_cov_file}"])
-
-    print(f"Merging coverage...")
-    print("Running command:", " ".join(cmd))
-    subprocess.run(cmd, check=True)
-    
-    print(f"Cleaning work folder")
-    clean_cov_dir(work_dir, f"{work_dir}/{merged_cov_file}")
+# Dump formats covered can score, as (vvp dump option, covered score option),
+# cheapest first. covered 0.7.x scores FST with -fst, LXT2 with -lxt.
+COVERED_DUMP_FORMATS = {
+    "fst":  ("-fst", "-fst"),
+    "lxt2": ("-lxt2", "-lxt"),
+    "vcd":  (None, "-vcd"),
+}
 
+def cheapest_dump(hier_path):
+    # The smallest dump that still scores correctly: only the scored scope, in
+    # the most compact format covered reads. Returns (format, tb.v DUMP_SCOPE).
+    scope = "user_peripheral" if hier_path == "tb.test_harness.user_peripheral" else "tb"
+    return next(iter(COVERED_DUMP_FORMATS)), scope
 
 def clean_cov_dir(cov_dir, exceptions=[]):
     print(f"Cleaning coverage directory: {cov_dir}")
-    cdd_files = [f for f in os.listdir(cov_dir) if f.endswith('.cdd')]
+    cdd_files = [f for f in os.listdir(cov_dir) if f.endswith(('.cdd', '.dat'))]
     vcd_files = [f for f in os.listdir(cov_dir) if f.endswith('.vcd')]
 
     for ccd in cdd_files:
@@ -77,3 +43,230 @@ def report_coverage(cov_dir, cov_file, verbose):
 
     with open("coverage.log", "w") as log_file:
         process = subprocess.run(cmd, stdout=log_file, stderr=subprocess.STDOUT)
+
+    # The same report as JSON, with the uncovered items listed even when the log is a summary
+    try:
+        text = open("coverage.log").read() if verbose else run_report(f"{cov_dir}/{cov_file}")
+        write_json(parse_report(text), "coverage.json")
+    except (subprocess.CalledProcessError, OSError) as e:
+        print(f"Could not write coverage.json: {e}")
+
+
+def score_coverage(srcs, top_module, hier_path, vcd, seed, cov_dir="cov", dump_format="vcd", keep_vcd=False, remove_dir=None,
+                   archive_dir=None, report=False):
+    # Score one seed and delete its waves straight away, returns the .cdd path.
+    # A copy of the seed's own .cdd goes in archive_dir, as merging consumes it.
+    # With report, returns (.cdd path, parsed report) so the seed's own coverage can be tracked.
+    cdd = f"{cov_dir}/cov_{seed}.cdd"
+    cmd = ["covered", "score"]
+    for src in srcs:
+        cmd.extend(["-v", src])
+    cmd.extend(["-t", top_module, "-i", hier_path, COVERED_DUMP_FORMATS[dump_format][1], vcd, "-o", cdd])
+    subprocess.run(cmd, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    if archive_dir is not None:
+        shutil.copy(cdd, archive_dir)
+    if not keep_vcd:
+        os.remove(vcd)
+    if remove_dir is not None:
+        shutil.rmtree(remove_dir, ignore_errors=True)
+    if report:
+        return cdd, parse_report(run_report(cdd))
+    return cdd
+
+def merge_cdds(cdd_files, merged_cov_file, remove_inputs=True):
+    # Merge the given .cdd files into merged_cov_file, which may also be one of the inputs
+    temp_file = f"{merged_cov_file}.tmp"
+    cmd = ["covered", "merge", *cdd_files, "-o", temp_file]
+    subprocess.run(cmd, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    os.replace(temp_file, merged_cov_file)
+    if remove_inputs:
+        for cdd in cdd_files:
+            if cdd != merged_cov_file:
+                os.remove(cdd)
+    return merged_cov_file
+
+def collect_verilator_coverage(dat, seed, cov_dir="cov", remove_dir=None, archive_dir=None):
+    # Verilator writes each seed's coverage as it exits, there is nothing to score.
+    # Move it out of the scratch directory, returns the .dat path.
+    cov_dat = f"{cov_dir}/cov_{seed}.dat"
+    shutil.move(dat, cov_dat)
+    if archive_dir is not None:
+        shutil.copy(cov_dat, archive_dir)
+    if remove_dir is not None:
+        shutil.rmtree(remove_dir, ignore_errors=True)
+    return cov_dat
+
+def merge_verilator_dats(dat_files, merged_cov_file, remove_inputs=True):
+    # Same as merge_cdds, for Verilator coverage
+    temp_file = f"{merged_cov_file}.tmp"
+    cmd = ["verilator_coverage", "--write", temp_file, *dat_files]
+    subprocess.run(cmd, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    os.replace(temp_file, merged_cov_file)
+    if remove_inputs:
+        for dat in dat_files:
+            if dat != merged_cov_file:
+                os.remove(dat)
+    return merged_cov_file
+
+# Verilator coverage point types for each covered metric
+VERILATOR_METRICS = {"line": "line", "toggle": "toggle", "comb": "expr"}
+
+def report_verilator_coverage(cov_dir, cov_file):
+    # Annotated sources in cov_dir/annotated, the totals in coverage.log and coverage.json
+    cov_path = f"{cov_dir}/{cov_file}"
+    cmd = ["verilator_coverage", "--annotate", f"{cov_dir}/annotated", cov_path]
+    with open("coverage.log", "w") as log_file:
+        subprocess.run(cmd, stdout=log_file, stderr=subprocess.STDOUT)
+
+    report = {"modules": {}, "total": {}, "uncovered": {metric: [] for metric in METRICS}, "detailed": False}
+    for metric, point_type in VERILATOR_METRICS.items():
+        result = subprocess.run([*cmd, "--filter-type", point_type], stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+        total = re.search(r"Total coverage \((\d+)/(\d+)\)", result.stdout)
+        if result.returncode == 0 and total and int(total.group(2)):
+            report["total"][metric] = {"hit": int(total.group(1)), "total": int(total.group(2))}
+    write_json(report, "coverage.json")
+
+class CoverageMerger:
+    # Scores seeds in a process pool while the simulations run, and merges the
+    # results pairwise as a tree: two .cdd files of the same level merge into
+    # one of the next level. At the end only one file per level is left to merge.
+
+    extension = "cdd"
+    merge_files = staticmethod(merge_cdds)
+
+    def __init__(self, cov_dir="cov", max_workers=None):
+        self.cov_dir = cov_dir
+        # Forked workers would inherit the pipes of simulations running in other
+        # threads and hold them open, so start them from a forkserver instead
+        self.pool = concurrent.futures.ProcessPoolExecutor(max_workers=max_workers,
+                                                           mp_context=multiprocessing.get_context("forkserver"))
+        self.lock = threading.Condition()
+        self.levels = {}
+        self.outstanding = 0
+        self.merges = 0
+        self.errors = []
+
+    def score(self, on_report=None, **kwargs):
+        # on_report, if given, is called with the parsed report of the seed
+        self._submit(0, score_coverage, cov_dir=self.cov_dir, report=on_report is not None, on_report=on_report, **kwargs)
+
+    def _submit(self, level, fn, *args, on_report=None, **kwargs):
+        with self.lock:
+            self.outstanding += 1
+        future = self.pool.submit(fn, *args, **kwargs)
+        future.add_done_callback(lambda done: self._done(level, done, on_report))
+
+    def _done(self, level, future, on_report=None):
+        try:
+            cdd = future.result()
+            if on_report is not None:
+                cdd, report = cdd
+                on_report(report)
+            self._add(level, cdd)
+        except Exception as e:
+            with self.lock:
+                self.errors.append(e)
+        with self.lock:
+            self.outstanding -= 1
+            self.lock.notify_all()
+
+    def _add(self, level, cdd):
+        with self.lock:
+            other = self.levels.pop(level, None)
+            if other is None:
+                self.levels[level] = cdd
+                return
+            self.merges += 1
+            merged = f"{self.cov_dir}/merge_{level + 1}_{self.merges}.{self.extension}"
+        self._submit(level + 1, self.merge_files, [other, cdd], merged)
+
+    def finish(self, merged_cov_file="merged.cdd"):
+        # Wait for all scoring and merging, then fold what is left into merged_cov_file
+        with self.lock:
+            while self.outstanding:
+                self.lock.wait()
+        self.pool.shutdown()
+        for e in self.errors:
+            print(f"Coverage failed: {e}")
+
+        merged_path = f"{self.cov_dir}/{merged_cov_file}"
+        cdd_files = [self.levels[level] for level in sorted(self.levels)]
+        if os.path.exists(merged_path):
+            cdd_files.append(merged_path)
+        if not cdd_files:
+            print("No coverage to merge")
+        elif len(cdd_files) == 1:
+            os.replace(cdd_files[0], merged_path)
+        else:
+            print(f"Merging {len(cdd_files)} coverage files into {merged_path}")
+            self.merge_files(cdd_files, merged_path)
+        self.levels = {}
+
+class VerilatorCoverageMerger(CoverageMerger):
+    # The same tree merge for the coverage.dat files of Verilator runs
+
+    extension = "dat"
+    merge_files = staticmethod(merge_verilator_dats)
+
+    def score(self, on_report=None, **kwargs):
+        if on_report is not None:
+            raise ValueError("Per-seed coverage reports need covered, not Verilator coverage")
+        self._submit(0, collect_verilator_coverage, cov_dir=self.cov_dir, **kwargs)
+
+class CoverageTracker:
+    # Follows what each seed adds to the merged coverage, from the items each
+    # seed missed: the merged coverage misses only what every seed missed.
+    # A seed that runs several tests misses only what all of them missed.
+    # Coverage is flat once `window` runs in a row have added nothing.
+
+    def __init__(self, window=None):
+        self.window = window
+        self.lock = threading.Lock()
+        self.missed = {}
+        self.merged_missed = None
+        self.totals = {}
+        self.since_gain = 0
+        self.flat = threading.Event()
+
+    def add(self, seed, report):
+        items = uncovered_items(report)
+        with self.lock:
+            self.missed[seed] = self.missed[seed] & items if seed in self.missed else items
+            self.totals = report["total"] or self.totals
+            if self.merged_missed is None:
+                gained = bool(self.totals)
+                self.merged_missed = items
+            else:
+                gained = bool(self.merged_missed - items)
+                self.merged_missed &= items
+            self.since_gain = 0 if gained else self.since_gain + 1
+            if self.window and self.since_gain >= self.window:
+                self.flat.set()
+
+    def hits(self):
+        # {metric: (hit, total)} of the merged coverage so far
+        with self.lock:
+            missed = self.merged_missed or frozenset()
+            return {metric: (self.totals[metric]["total"] - sum(item.startswith(f"{metric}:") for item in missed),
+                             self.totals[metric]["total"])
+                    for metric in METRICS if metric in self.totals}
+
+    def minimal_seeds(self):
+        # A small set of seeds with the same merged coverage as all of them, picked
+        # greedily: each next seed covers the most items the chosen ones still miss
+        with self.lock:
+            if not self.missed:
+                return []
+            remaining = frozenset().union(*self.missed.values()) - self.merged_missed
+            covers = {seed: remaining - missed for seed, missed in self.missed.items()}
+            chosen = [max(covers, key=lambda seed: len(covers[seed]))]
+            remaining -= covers[chosen[0]]
+            while remaining:
+                seed = max(covers, key=lambda seed: len(covers[seed] & remaining))
+                chosen.append(seed)
+                remaining -= covers[seed]
+            return chosen
+
+    def summary(self):
+        hits = self.hits()
+        return ", ".join(f"{metric} {hit}/{total}" for metric, (hit, total) in hits.items())
@@ -0,0 +1,221 @@
+import argparse
+import json
+import re
+import subprocess
+import sys
+
+# Report sections, by the heading covered prints above them
+SECTIONS = {
+    "LINE COVERAGE RESULTS": "line",
+    "TOGGLE COVERAGE RESULTS": "toggle",
+    "COMBINATIONAL LOGIC COVERAGE RESULTS": "comb",
+}
+METRICS = ("line", "toggle", "comb")
+
+SECTION_RE = re.compile(r"^~+\s+([A-Z ]+?)\s+~+$")
+SUMMARY_RE = re.compile(r"^  (\S+)\s+(?:([^\s/]+)\s+)?(\d+)/\s*(\d+)/\s*(\d+)\s+\d+%(?:\s+(\d+)/\s*(\d+)/\s*(\d+)\s+\d+%)?\s*$")
+MODULE_RE = re.compile(r"^\s+Module: (\S+), File: (\S+)")
+LINE_RE = re.compile(r"^\s+(\d+):    ")
+TOGGLE_RE = re.compile(r"^\s+(\S+?)\s+(0->1|1->0): (\d+)'h([0-9a-fA-F_]+)")
+EXPRESSION_RE = re.compile(r"^\s+Expression (\d+)\s+\((\d+)/(\d+)\)")
+
+def run_report(cdd, metrics="ltc"):
+    # Verbose report of the missed items of one .cdd file
+    cmd = ["covered", "report", "-d", "v", "-m", metrics, cdd]
+    return subprocess.run(cmd, check=True, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True).stdout
+
+def parse_report(text):
+    # Parse a covered report into summary counts and the missed items of each metric.
+    # Missed items are strings that identify the same item across reports of the same RTL:
+    #   line   "module:line"
+    #   toggle "module:signal[bit]:0->1"
+    #   comb   "module:line:expression:combination"
+    report = {
+        "modules": {},
+        "total": {},
+        "uncovered": {metric: [] for metric in METRICS},
+        # Only detailed and verbose reports list the uncovered items
+        "detailed": bool(re.search(r"Coverage (Detailed|Verbose) Report", text)),
+    }
+    section = module = line = expression = None
+    toggle_signal = None
+    table = []
+
+    for text_line in text.splitlines():
+        heading = SECTION_RE.match(text_line)
+        if heading:
+            section = SECTIONS.get(heading.group(1))
+            module = None
+            continue
+        if section is None:
+            continue
+
+        summary = SUMMARY_RE.match(text_line)
+        if summary and module is None:
+            name, filename = summary.group(1), summary.group(2)
+            hit, total = int(summary.group(3)), int(summary.group(5))
+            if summary.group(6):
+                hit, total = hit + int(summary.group(6)), total + int(summary.group(8))
+            counts = {"hit": hit, "total": total}
+            if name == "Accumulated":
+                report["total"][section] = counts
+            elif name != "$root":
+                report["modules"].setdefault(name, {"file": filename})[section] = counts
+            continue
+
+        detail = MODULE_RE.match(text_line)
+        if detail:
+            module, line, expression = detail.group(1), None, None
+            report["modules"].setdefault(module, {})["file"] = detail.group(2)
+            continue
+        if module is None:
+            continue
+
+        uncovered = report["uncovered"][section]
+        if section == "line":
+            missed = LINE_RE.match(text_line)
+            if missed:
+                uncovered.append(f"{module}:{missed.group(1)}")
+
+        elif section == "toggle":
+            toggle = TOGGLE_RE.match(text_line)
+            if toggle:
+                if not toggle.group(1).startswith("."):
+                    toggle_signal = toggle.group(1)
+                width, value = int(toggle.group(3)), int(toggle.group(4).replace("_", ""), 16)
+                for bit in range(width):
+                    if not value >> bit & 1:
+                        name = toggle_signal if width == 1 else f"{toggle_signal}[{bit}]"
+                        uncovered.append(f"{module}:{name}:{toggle.group(2)}")
+
+        elif section == "comb":
+            missed = LINE_RE.match(text_line)
+            if missed:
+                line = missed.group(1)
+                continue
+            header = EXPRESSION_RE.match(text_line)
+            if header:
+                expression, table = header.group(1), []
+                continue
+            if expression is None:
+                continue
+            if not text_line.strip():
+                expression = None
+                continue
+            if "*" in text_line and not text_line.strip().startswith("^"):
+                for combination in missed_combinations(table, text_line):
+                    uncovered.append(f"{module}:{line}:{expression}:{combination}")
+            table.append(text_line)
+
+    report["modules"] = untruncate_modules(report["modules"])
+    return report
+
+def untruncate_modules(modules):
+    # The line and toggle summaries cut module names to 20 characters, fold
+    # those into the full name from the combinational summary or the details
+    full_names = [name for name in modules if len(name) > 20]
+    merged = {}
+    for name, counts in modules.items():
+        matches = [full for full in full_names if full.startswith(name)] if len(name) == 20 else []
+        full = matches[0] if len(matches) == 1 else name
+        merged.setdefault(full, {}).update({key: value for key, value in counts.items()
+                                            if key != "file" or "/" in value or "file" not in merged.get(full, {})})
+    return merged
+
+def missed_combinations(table, marks):
+    # Name each * in a combination table by the =value= cell above it, or by its column
+    labels = [row for row in table if row.strip().startswith("=")]
+    for column, char in enumerate(marks):
+        if char != "*":
+            continue
+        if labels and column < len(labels[-1]):
+            row = labels[-1]
+            start = row.rfind("|", 0, column) + 1
+            end = row.find("|", column)
+            cell = row[start:end if end >= 0 else None].strip("= ")
+            yield cell or str(column)
+        else:
+            yield str(column)
+
+def uncovered_items(report):
+    # All missed items of a parsed report, tagged with their metric
+    return frozenset(f"{metric}:{item}" for metric in METRICS for item in report["uncovered"][metric])
+
+def load_report(path):
+    # A report as JSON, or the covered report text it came from
+    with open(path) as f:
+        text = f.read()
+    return json.loads(text) if text.lstrip().startswith("{") else parse_report(text)
+
+def write_json(report, path):
+    with open(path, "w") as f:
+        json.dump(report, f, indent=1, sort_keys=True)
+
+def diff_reports(old, new):
+    # What new gained and lost against old: hit count deltas per metric and module,
+    # and the items that went from uncovered to covered and back
+    diff = {"total": {}, "modules": {}, "gained": {}, "lost": {}}
+    for metric in METRICS:
+        old_total, new_total = old["total"].get(metric, {}), new["total"].get(metric, {})
+        diff["total"][metric] = {
+            "hit": new_total.get("hit", 0) - old_total.get("hit", 0),
+            "total": new_total.get("total", 0) - old_total.get("total", 0),
+        }
+        old_uncovered, new_uncovered = set(old["uncovered"][metric]), set(new["uncovered"][metric])
+        both_detailed = old.get("detailed") and new.get("detailed")
+        diff["gained"][metric] = sorted(old_uncovered - new_uncovered) if both_detailed else []
+        diff["lost"][metric] = sorted(new_uncovered - old_uncovered) if both_detailed else []
+
+    for module in sorted(set(old["modules"]) | set(new["modules"])):
+        deltas = {}
+        for metric in METRICS:
+            old_counts = old["modules"].get(module, {}).get(metric, {})
+            new_counts = new["modules"].get(module, {}).get(metric, {})
+            delta = new_counts.get("hit", 0) - old_counts.get("hit", 0)
+            if delta:
+                deltas[metric] = delta
+        if deltas:
+            diff["modules"][module] = deltas
+    return diff
+
+def print_diff(diff):
+    for metric, delta in diff["total"].items():
+        print(f"{metric:>6}: {delta['hit']:+d} hit, {len(diff['gained'][metric])} items gained, {len(diff['lost'][metric])} lost")
+    for module, deltas in diff["modules"].items():
+        print(f"  {module}: " + ", ".join(f"{metric} {delta:+d}" for metric, delta in deltas.items()))
+    for change in ("gained", "lost"):
+        for metric, items in diff[change].items():
+            for item in items:
+                print(f"  {change} {metric} {item}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert covered reports to JSON and compare them.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    parse = subparsers.add_parser("parse", help="Convert a covered report to JSON")
+    parse.add_argument("report", help="covered report text (use -d v to list uncovered items)")
+    parse.add_argument("-o", default=None, help="JSON output (default: stdout)")
+    diff = subparsers.add_parser("diff", help="Compare two reports, text or JSON")
+    diff.add_argument("old")
+    diff.add_argument("new")
+    diff.add_argument("-json", action="store_true", help="Print the difference as JSON")
+    diff.add_argument("-fail_on_loss", action="store_true", help="Exit with an error if any metric lost hits")
+    args = parser.parse_args()
+
+    if args.command == "parse":
+        report = load_report(args.report)
+        if args.o:
+            write_json(report, args.o)
+        else:
+            json.dump(report, sys.stdout, indent=1, sort_keys=True)
+        return
+
+    difference = diff_reports(load_report(args.old), load_report(args.new))
+    if args.json:
+        json.dump(difference, sys.stdout, indent=1, sort_keys=True)
+    else:
+        print_diff(difference)
+    if args.fail_on_loss and any(delta["hit"] < 0 for delta in difference["total"].values()):
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
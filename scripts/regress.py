@@ -1,208 +1,623 @@
 import subprocess
 import random
 import os
+import shutil
+import signal
+import sys
 import argparse
+import ast
+import gzip
+import json
+import queue
+import threading
+import time
+import xml.etree.ElementTree as ET
+from collections import deque
 from datetime import datetime
-import concurrent.futures
+from functools import lru_cache
 from tqdm import tqdm
-from coverage import get_coverage, merge_coverage, clean_cov_dir, report_coverage
-
-def run_test(runs=1, width=5):
-    # find all directories with a test Makefile inside
-    folders_with_makefile = []
-    for root, _, files in os.walk("."):
-        if "Makefile" in files or "makefile" in files:
-            folders_with_makefile.append(root)
-    if '.' in folders_with_makefile:
-        folders_with_makefile.remove('.')
-    print(f"Test directories: {folders_with_makefile}")
-
-    def run_make(folder, run_idx, position):
-        module_name = os.path.basename(os.path.abspath(folder))
-        desc = f"{module_name} run {run_idx}"
-        log_header = f"\n=== {desc} ===\n"
-
-        # Start a separate progress bar for this task
-        with tqdm(total=1, desc=desc, position=position, leave=True) as pbar:
-            result = subprocess.run(
-                ["make"],
-                cwd=folder,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.STDOUT,
-                text=True
-            )
-            pbar.update(1)
-
-        return log_header + result.stdout
-
-    # Create a flat list of all tasks
-    tasks = []
-    for folder in folders_with_makefile:
-        for run_idx in range(1, runs + 1):
-            tasks.append((folder, run_idx))
-    print(f"Total tasks: {len(tasks)}")
-    print(f"Running {min(width, len(tasks))} batches at a time.")
-
-    logs = [None] * len(tasks)
-    with concurrent.futures.ThreadPoolExecutor(max_workers=min(width, len(tasks))) as executor:
-        future_to_idx = {}
-        for idx, (folder, run_idx) in enumerate(tasks):
-            position = idx % width  # position for tqdm to avoid overlapping bars
-            future = executor.submit(run_make, folder, run_idx, position)
-            future_to_idx[future] = idx
-
-        for future in concurrent.futures.as_completed(future_to_idx):
-            idx = future_to_idx[future]
-            logs[idx] = future.result()
-
-    # Write all logs to the master log file in order
-    master_log_filename = "latest_regress.log"
-    with open(master_log_filename, "a") as master_log:
-        master_log.write(f"=== Regression Log ===\n")
-        master_log.write(f"Timestamp: {datetime.now().isoformat()}\n")
-        master_log.write(f"Test directories: {folders_with_makefile}\n")
-        master_log.write(f"Repetitions per directory: {runs}\n")
-        master_log.write(f"Threads used: {min(width, len(tasks))}\n")
-        master_log.write(f"Total tasks: {len(tasks)}\n")
-        master_log.write(f"========================\n\n")
-        for log in logs:
-            master_log.write(log)
-
-def main():
-    parser = argparse.ArgumentParser(description="Run make in folders with Makefile.")
-    parser.add_argument("-runs", type=int, default=1, help="Number of repetitions per folder")
-    parser.add_argument("-width", type=int, default=4, help="Number of threads to use")
-    args = parser.parse_args()
-    run_test(runs=args.runs, width=args.width)
-
-if __name__ == "__main__":import subprocess
-import os
-import argparse
-from datetime import datetime
-import concurrent.futures
-from tqdm import tqdm
-
-def run_test(runs=1, width=5, clean=False, cov_dir="cov"):
+from coverage import (CoverageMerger, CoverageTracker, VerilatorCoverageMerger, COVERED_DUMP_FORMATS, cheapest_dump,
+                      clean_cov_dir, report_coverage, report_verilator_coverage)
+from covered_report import diff_reports, load_report, print_diff
+from results_db import ResultsDB, rtl_hash, test_hash
+
+# Must match SIM_BUILD for RTL simulation in the test Makefile, and the image cocotb builds there
+SIMULATORS = {
+    "icarus": ("sim_build/rtl", "sim.vvp"),
+    "verilator": ("sim_build/rtl_verilator", "Vtop"),
+}
+
+# Verilator traces the whole design, in either of these formats
+VERILATOR_DUMP_FORMATS = ["fst", "vcd"]
+
+# RTL sources scored for coverage, as listed in PROJECT_SOURCES in the test Makefile
+SRC_DIR = "./../src"
+COVERAGE_SRCS = [f"{SRC_DIR}/Receiver_Core.v", f"{SRC_DIR}/snes_nes_rec_peripheral.v"]
+COVERAGE_TOP = "tqvp_nes_snes_controller"
+COVERAGE_HIER = "tb.test_harness.user_peripheral"
+
+# Each seed's output is streamed to <log_dir>/<run_name>.log.gz, failing seeds keep all
+# of it and passing seeds only the last lines. index.jsonl lists every seed's log.
+LOG_TAIL_LINES = 40
+LOG_INDEX = "index.jsonl"
+
+def find_test_folders(top="./.."):
     # Find all directories with a test Makefile inside
     folders_with_makefile = []
-    for root, _, files in os.walk("./.."):
+    for root, _, files in os.walk(top):
         if "Makefile" in files or "makefile" in files:
             folders_with_makefile.append(root)
     if '.' in folders_with_makefile:
         folders_with_makefile.remove('.')
+    return folders_with_makefile
+
+def find_testcases(folder, module="test"):
+    # Names of the @cocotb.test() functions in the folder's test modules, in file order
+    testcases = []
+    for name in module.split(","):
+        path = os.path.join(folder, f"{name.strip()}.py")
+        if not os.path.exists(path):
+            continue
+        with open(path) as f:
+            tree = ast.parse(f.read(), path)
+        for node in tree.body:
+            if not isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)):
+                continue
+            for decorator in node.decorator_list:
+                target = decorator.func if isinstance(decorator, ast.Call) else decorator
+                if isinstance(target, ast.Attribute) and target.attr == "test" and \
+                        isinstance(target.value, ast.Name) and target.value.id == "cocotb":
+                    testcases.append(node.name)
+                    break
+    return testcases
+
+@lru_cache(maxsize=None)
+def cocotb_config(*args):
+    return subprocess.run(["cocotb-config", *args], check=True, stdout=subprocess.PIPE, text=True).stdout.strip()
+
+def compile_rtl(folder, sim="icarus", make_vars=()):
+    # Build the simulation image once per test folder, every seed runs against it.
+    # Verilator's build options are not make dependencies, so always rebuild it.
+    print(f"Compiling {folder} for {sim}")
+    result = subprocess.run(
+        ["make", *(["-B"] if sim == "verilator" else []), "compile", f"SIM={sim}", *make_vars],
+        cwd=folder,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.STDOUT,
+        text=True
+    )
+    if result.returncode != 0:
+        print(result.stdout)
+        raise RuntimeError(f"Compilation failed in {folder}")
+    return os.path.abspath(os.path.join(folder, *SIMULATORS[sim]))
+
+def simulator_command(sim_image, plusargs, sim="icarus"):
+    # What the cocotb Makefiles run, without make and its dependency checks.
+    # The Verilator model has cocotb linked in already.
+    if sim == "verilator":
+        return [sim_image, *plusargs]
+    return [
+        "vvp",
+        "-M", cocotb_config("--lib-dir"),
+        "-m", cocotb_config("--lib-name", "vpi", "icarus"),
+        sim_image,
+        *plusargs
+    ]
+
+def simulator_env(folder, seed, results_file, compress, profile=False, spi_trace=False, testcase=None, latency=False):
+    # The environment the cocotb Makefiles export to the simulator
+    env = dict(os.environ)
+    env.update({
+        "MODULE": os.environ.get("MODULE", "test"),
+        "TOPLEVEL": "tb",
+        "TOPLEVEL_LANG": "verilog",
+        "RANDOM_SEED": str(seed),
+        "COCOTB_RESULTS_FILE": results_file,
+        "NES_TIME_COMPRESSION": str(compress),
+        "LIBPYTHON_LOC": cocotb_config("--libpython"),
+        # The simulator runs in a scratch directory, so the tests need to be on the path
+        "PYTHONPATH": os.pathsep.join(filter(None, [os.path.abspath(folder), os.environ.get("PYTHONPATH")])),
+    })
+    if profile:
+        env["PROFILE"] = "1"
+        env["PROFILE_FILE"] = "profile.jsonl"
+    if spi_trace:
+        env["SPI_TRACE"] = "spi.trace"
+    if latency:
+        env["LATENCY"] = "1"
+        env["LATENCY_FILE"] = "latency.jsonl"
+    if testcase:
+        env["TESTCASE"] = testcase
+    if sys.prefix == sys.base_prefix:
+        env["PYTHONHOME"] = sys.prefix
+    return env
+
+def test_results(results_file):
+    # Any failure or error in the cocotb results, or no results at all, fails the seed.
+    # Returns (status, simulated ns summed over the tests).
+    if not os.path.exists(results_file):
+        return "FAIL", None
+    status, ran, sim_ns = "PASS", False, 0.0
+    for testcase in ET.parse(results_file).getroot().iter("testcase"):
+        ran = True
+        sim_ns += float(testcase.get("sim_time_ns", 0))
+        if testcase.find("failure") is not None or testcase.find("error") is not None:
+            status = "FAIL"
+    return (status if ran else "FAIL"), sim_ns
+
+def stream_output(pipe, log_path, tail):
+    # Compress the simulator's output as it arrives, only the last lines stay in memory
+    with gzip.open(log_path, "wt") as log:
+        for line in pipe:
+            log.write(line)
+            tail.append(line)
+
+def finish_log(log_path, tail, header, keep_all):
+    # Failing seeds keep the whole log with the header appended as a gzip member of its
+    # own, passing seeds are cut down to the header and the tail
+    if keep_all:
+        with gzip.open(log_path, "at") as log:
+            log.write(header)
+        return
+    with gzip.open(log_path, "wt") as log:
+        log.write(header)
+        log.write(f"--- Last {len(tail)} lines ---\n")
+        log.writelines(tail)
+
+def run_make(folder, run_idx, sim_image, work_dir, compress=1, timeout=None, dump=("vcd", "tb"), seed=None, profile=False,
+             sim="icarus", trace_dir=None, testcase=None, log_dir="logs", latency=False):
+
+    # Each seed runs in its own scratch directory, and only testcase if one is given
+    seed = seed or random.randint(10**9, 10**10 - 1)
+    module_name = os.path.basename(os.path.abspath(folder))
+    test = f"{module_name}.{testcase}" if testcase else module_name
+    run_name = f"{module_name}_{testcase}_{seed}" if testcase else f"{module_name}_{seed}"
+    desc = f"[{test} run {run_idx}] Using seed {seed}"
+    seed_dir = os.path.abspath(os.path.join(work_dir, run_name))
+    os.makedirs(seed_dir, exist_ok=True)
+    dump_format, dump_scope = dump
+    vcd_path = os.path.join(seed_dir, f"tb.{dump_format}") if dump_format else None
+    results_file = os.path.join(seed_dir, "results.xml")
+    coverage_dat = None
+
+    if sim == "verilator":
+        # Verilator writes its own coverage, waves only if the model was built with tracing
+        coverage_dat = os.path.join(seed_dir, "coverage.dat")
+        plusargs = [f"+verilator+coverage+file+{coverage_dat}"]
+        if dump_format:
+            plusargs += ["--trace", "--trace-file", vcd_path]
+    elif dump_format:
+        plusargs = [f"+VCD_PATH={vcd_path}", f"+DUMP_SCOPE={dump_scope}"]
+        vvp_dump_option = COVERED_DUMP_FORMATS[dump_format][0]
+        if vvp_dump_option:
+            plusargs.append(vvp_dump_option)
+    else:
+        plusargs = ["+DUMP_SCOPE=none"]
+    cmd = simulator_command(sim_image, plusargs, sim)
+
+    # A rerun of a kept failing seed must not read the results of the last run
+    if os.path.exists(results_file):
+        os.remove(results_file)
+
+    # Run the simulator in its own process group, so a hung simulation can be killed.
+    # Its output goes straight to the seed's compressed log.
+    log_path = os.path.join(log_dir, f"{run_name}.log.gz")
+    tail = deque(maxlen=LOG_TAIL_LINES)
+    start = time.monotonic()
+    process = subprocess.Popen(
+        cmd,
+        cwd=seed_dir,
+        env=simulator_env(folder, seed, results_file, compress, profile, spi_trace=trace_dir is not None, testcase=testcase,
+                          latency=latency),
+        stdout=subprocess.PIPE,
+        stderr=subprocess.STDOUT,
+        text=True,
+        start_new_session=True
+    )
+    reader = threading.Thread(target=stream_output, args=(process.stdout, log_path, tail))
+    reader.start()
+    notes = ""
+    try:
+        process.wait(timeout=timeout)
+        status, sim_ns = test_results(results_file)
+    except subprocess.TimeoutExpired:
+        os.killpg(process.pid, signal.SIGKILL)
+        process.wait()
+        notes += f"--- Killed after {timeout}s timeout ---\n"
+        status, sim_ns = "TIMEOUT", None
+    reader.join()
+    process.stdout.close()
+    duration = time.monotonic() - start
+    dump_bytes = os.path.getsize(vcd_path) if vcd_path and os.path.exists(vcd_path) else 0
+    profiles = read_jsonl(os.path.join(seed_dir, "profile.jsonl")) if profile else []
+    latencies = read_jsonl(os.path.join(seed_dir, "latency.jsonl")) if latency else []
+
+    # Passing seeds' scratch directories are removed once scored, so move the SPI trace out
+    spi_trace = None
+    if trace_dir is not None and os.path.exists(os.path.join(seed_dir, "spi.trace")):
+        spi_trace = shutil.move(os.path.join(seed_dir, "spi.trace"), os.path.join(trace_dir, f"{run_name}.trace"))
+
+    # Keep the scratch directory of failing seeds for debug
+    if status != "PASS":
+        notes += f"--- Results kept in {seed_dir} ---\n"
+
+    log_header = f"=== {desc} {status} in {duration:.1f}s, {dump_bytes} bytes of {dump_format} ===\n"
+    finish_log(log_path, tail, log_header + notes, keep_all=status != "PASS")
+    return {"desc": desc, "test": test, "run_name": run_name, "seed": seed, "status": status, "duration": duration, "sim_ns": sim_ns,
+            "log": log_path, "vcd": vcd_path, "dump_format": dump_format, "dump_bytes": dump_bytes, "seed_dir": seed_dir,
+            "coverage_dat": coverage_dat, "profiles": profiles, "latencies": latencies,
+            "spi_trace": spi_trace}
+
+def read_jsonl(path):
+    # The per-test records the profiling layer or the latency monitor append, if they ran
+    if not os.path.exists(path):
+        return []
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+def aggregate_profiles(records):
+    # Totals per test over every seed, and per profiled function over every test
+    tests = {}
+    for record in records:
+        test = tests.setdefault(record["test"], {"seeds": 0, "wall_s": 0.0, "sim_ns": 0.0, "triggers": 0,
+                                                 "python_s": 0.0, "logging_s": 0.0, "functions": {}})
+        test["seeds"] += 1
+        for key in ("wall_s", "sim_ns", "triggers", "python_s", "logging_s"):
+            # Trigger counts and Python time are None (n/a) on cocotb versions profiling cannot hook
+            test[key] = None if test[key] is None or record[key] is None else test[key] + record[key]
+        for name, stats in record["functions"].items():
+            function = test["functions"].setdefault(name, {"calls": 0, "seconds": 0.0})
+            function["calls"] += stats["calls"]
+            function["seconds"] += stats["seconds"]
+    for test in tests.values():
+        test["sim_ns_per_s"] = test["sim_ns"] / max(test["wall_s"], 1e-9)
+    return tests
+
+def format_na(value, width, spec):
+    return f"{'n/a':>{width}}" if value is None else format(value, f">{width}{spec}")
+
+def print_profiles(tests):
+    print("Profile over all seeds:")
+    print(f"  {'test':<24} {'seeds':>5} {'wall(s)':>8} {'ns/s':>10} {'triggers':>10} {'python(s)':>9} {'logging(s)':>10}")
+    for name, test in tests.items():
+        print(f"  {name:<24} {test['seeds']:>5} {test['wall_s']:>8.1f} {test['sim_ns_per_s']:>10.0f} "
+              f"{format_na(test['triggers'], 10, '')} {format_na(test['python_s'], 9, '.1f')} {test['logging_s']:>10.1f}")
+        for function, stats in sorted(test["functions"].items(), key=lambda item: -item[1]["seconds"]):
+            print(f"    {function:<32} {stats['calls']:>10} calls {stats['seconds']:>8.2f} s")
+
+def score_seed(merger, result, archive_dir=None, tracker=None):
+    # Scoring runs in the merger's process pool, so the worker can start its next seed.
+    # The scratch directory (and VCD) of a passing seed goes as soon as it is scored.
+    # Returns where the seed's own .cdd will be kept, if anywhere.
+    if result["status"] == "TIMEOUT":
+        return None
+    passed = result["status"] == "PASS"
+    if not result["vcd"] and not result["coverage_dat"]:
+        # Run without waves, nothing to score
+        if passed:
+            shutil.rmtree(result["seed_dir"], ignore_errors=True)
+        return None
+    if result["coverage_dat"]:
+        if not os.path.exists(result["coverage_dat"]):
+            return None
+        merger.score(dat=result["coverage_dat"], seed=result["run_name"], remove_dir=result["seed_dir"] if passed else None,
+                     archive_dir=archive_dir)
+        return os.path.join(archive_dir, f"cov_{result['run_name']}.dat") if archive_dir else None
+    merger.score(srcs=COVERAGE_SRCS, top_module=COVERAGE_TOP, hier_path=COVERAGE_HIER,
+                 vcd=result["vcd"], dump_format=result["dump_format"], seed=result["run_name"], keep_vcd=not passed,
+                 remove_dir=result["seed_dir"] if passed else None, archive_dir=archive_dir,
+                 on_report=(lambda report: tracker.add(result["seed"], report)) if tracker else None)
+    return os.path.join(archive_dir, f"cov_{result['run_name']}.cdd") if archive_dir else None
+
+def run_test(runs=1, width=None, clean=False, cov_dir="cov", work_dir="work", compress=1, timeout=None, cov_width=None,
+             dump_format=None, dump_scope=None, db_path="regress.db", keep_cdd=False, seeds=None, tracker=None, profile=False,
+             sim="icarus", threads=None, trace_dir=None, log_dir="logs", two_phase=False, wave_sample=0, latency=False):
+    folders_with_makefile = find_test_folders()
     print(f"Test directories: {folders_with_makefile}")
 
-    # Create a flat list of all tasks
-    tasks = []
-    for folder in folders_with_makefile:
-        for run_idx in range(1, runs + 1):
-            tasks.append((folder, run_idx))
-    print(f"Total tasks: {len(tasks)}")
-
-    # Determine number of batches
-    num_batches = min(width, len(tasks))
-    print(f"Running {num_batches} tests concurrently.")
-
-    logs = [None] * len(tasks)
-    
-    # Write all logs to the master log file in order
-    master_log_filename = "latest_regress.log"
-    with open(master_log_filename, "a") as master_log:
-        master_log.write(f"=== Regression Log ===\n")
-        master_log.write(f"Timestamp: {datetime.now().isoformat()}\n")
-        master_log.write(f"Test directories: {folders_with_makefile}\n")
-        master_log.write(f"Repetitions per directory: {runs}\n")
-        master_log.write(f"Threads used: {num_batches}\n")
-        master_log.write(f"Total tasks: {len(tasks)}\n")
-        master_log.write(f"========================\n\n")
-        
-
-    def run_make(folder, run_idx, work_dir):
-
-        # Copy environment and set RANDOM_SEED
-        seed = random.randint(10**9, 10**10 - 1)
+    # The second pass of a two phase run needs a Verilator model that can trace
+    if two_phase and sim == "verilator":
+        dump_format = dump_format or VERILATOR_DUMP_FORMATS[0]
+
+    # Compile once, then run every seed against the same image
+    if sim == "verilator":
+        make_vars = ["VERILATOR_COVERAGE=1"]
+        if dump_format:
+            make_vars.append(f"DUMP_FORMAT={dump_format}")
+        if threads:
+            make_vars.append(f"VERILATOR_THREADS={threads}")
+    else:
+        make_vars = []
+    sim_images = {folder: compile_rtl(folder, sim, make_vars) for folder in folders_with_makefile}
+
+    # Every seed is recorded against the content of the RTL and the tests it ran
+    db = ResultsDB(db_path)
+    run_id = db.start_run(rtl_hash(SRC_DIR), test_hash("."), args=" ".join(sys.argv[1:]))
+    print(f"Recording run {run_id} in {db_path}")
+
+    # Each (test function, seed) pair is a task of its own, every test of a seed runs with
+    # the same RANDOM_SEED. Folders whose tests cannot be found run their whole module.
+    module = os.environ.get("MODULE", "test")
+    testcases = {folder: find_testcases(folder, module) or [None] for folder in folders_with_makefile}
+    seeds = seeds or [random.randint(10**9, 10**10 - 1) for _ in range(runs)]
+    task_list = [(folder, run_idx, seed, testcase)
+                 for folder in folders_with_makefile
+                 for run_idx, seed in enumerate(seeds, start=1)
+                 for testcase in testcases[folder]]
+
+    # Longest first from past runs, so a slow test does not start last and hold up the
+    # end of the regression. Tests never seen before go first, they might be slow.
+    durations = db.durations()
+    def expected_duration(task):
+        folder, _, _, testcase = task
         module_name = os.path.basename(os.path.abspath(folder))
-        desc = f"[{module_name} run {run_idx}] Using seed {seed}"
-        log_header = f"\n=== {desc} ===\n"
-        vcd_path = f"{work_dir}/tb_{seed}.vcd"
-
-        cmd = [
-        "make",
-        f"RANDOM_SEED={seed}",
-        f"VCD_PATH={vcd_path}"
-]
-        result = subprocess.run(
-            cmd,
-            cwd=folder,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.STDOUT,
-            text=True
-        )
-        src_dir = "./../src"
-        srcs = [f"{src_dir}/FPGA_NESReciever.v" , f"{src_dir}/peripheral.v" ]
-
-        get_coverage(srcs=srcs, vcd=vcd_path, top_module="tqvp_nes_snes_controller", hier_path="tb.test_harness.user_peripheral", seed=seed)
-
-          #  result.stdout += f"\n--- Coverage Output ---\n{coverage_result.stdout}\n"
-        return log_header + result.stdout, desc
-
-    # Run tasks in batches
-    with concurrent.futures.ThreadPoolExecutor(max_workers=num_batches) as executor:
-        for i in range(0, len(tasks), num_batches):
-            batch_tasks = tasks[i:i+num_batches]
-            # Print which tasks are running in this batch
-            batch_descs = [f"{os.path.basename(os.path.abspath(folder))} run {run_idx}" for folder, run_idx in batch_tasks]
-            print(f"Running test batch {i//num_batches + 1}: {batch_descs}")
-
-            futures = {
-                executor.submit(run_make, folder, run_idx, cov_dir): idx
-                for idx, (folder, run_idx) in enumerate(batch_tasks, start=i)
-            }
-
-            # One progress bar for this batch
-            with tqdm(total=len(batch_tasks), desc=f"Batch {i//num_batches + 1}", leave=True) as pbar:
-                for future in concurrent.futures.as_completed(futures):
-                    idx = futures[future]
-                    result_log, test_desc = future.result()
-                    logs[idx] = result_log
-                    # Update progress bar with the current test
-                    pbar.set_postfix_str(test_desc)
-                    pbar.update(1)
-
-            print(f"Batch {i//num_batches + 1} finished!")
-
-
-    # write all logs to the master regression log
-    with open(master_log_filename, "a") as master_log:
-         for log in logs:
-            master_log.write(log)
+        return durations.get(f"{module_name}.{testcase}" if testcase else module_name, float("inf"))
+    task_list.sort(key=expected_duration, reverse=True)
+
+    num_tasks = len(task_list)
+    print(f"Total tasks: {num_tasks} ({', '.join(f'{len(names)} tests in {folder}' for folder, names in testcases.items())})")
+
+    num_workers = max(1, min(width or os.cpu_count() or 1, num_tasks))
+    print(f"Running {num_workers} tests concurrently.")
+
+    # Each seed streams its own log, the index lists them as tasks complete
+    index_path = os.path.join(log_dir, LOG_INDEX)
+    index = open(index_path, "w")
+    index.write(json.dumps({"run_id": run_id, "timestamp": datetime.now().isoformat(), "test_dirs": folders_with_makefile,
+                            "runs": runs, "threads": num_workers, "tasks": num_tasks}) + "\n")
+    print(f"Logging each seed to {log_dir}, indexed in {index_path}")
+
+    if sim == "verilator":
+        # Coverage comes from Verilator itself, so waves are only for debug
+        dump = (dump_format, "tb")
+        merger = VerilatorCoverageMerger(cov_dir=cov_dir, max_workers=cov_width or 1)
+    else:
+        # Dump only what coverage needs, in the cheapest format covered can read
+        cheapest_format, cheapest_scope = cheapest_dump(COVERAGE_HIER)
+        dump = (dump_format or cheapest_format, dump_scope or cheapest_scope)
+        merger = CoverageMerger(cov_dir=cov_dir, max_workers=cov_width or max(1, (os.cpu_count() or 2) // 2))
+    if two_phase:
+        # The first pass runs without waves, covered only scores the reruns of the second.
+        # Verilator's coverage does not need waves, so it is all taken from the first pass.
+        wave_dump = (dump[0], dump_scope or "tb")
+        dump = (None, "none")
+        print(f"Dumping no waves, then {wave_dump[1]} as {wave_dump[0]} for the reruns")
+    else:
+        print(f"Dumping {dump[1] + ' as ' + dump[0] if dump[0] else 'no waves'}")
+    archive_dir = os.path.abspath(os.path.join(cov_dir, "seeds")) if keep_cdd else None
+    if archive_dir:
+        os.makedirs(archive_dir, exist_ok=True)
+
+    log_lock = threading.Lock()
+    busy = [0.0] * num_workers
+    completed = [0] * num_workers
+    statuses = {}
+    test_statuses = {}
+    dump_bytes = []
+    profiles = []
+    latencies = []
+
+    failed_tasks = []
+    passed_tasks = []
+    reruns = {}
+
+    def worker(worker_idx, pbar, tasks, phase):
+        # Phase 1 is the regression itself. Phase 2 reruns seeds of a two phase run with
+        # waves, its results go to the index and reruns only, the first pass decides.
+        phase_dump, phase_logs = (dump, log_dir) if phase == 1 else (wave_dump, os.path.join(log_dir, "waves"))
+        while True:
+            # Stop taking seeds once they no longer add coverage
+            if tracker and tracker.flat.is_set():
+                return
+            try:
+                task = tasks.get_nowait()
+            except queue.Empty:
+                return
+            folder, run_idx, seed, testcase = task
+            task_start = time.monotonic()
+            result = run_make(folder, run_idx, sim_images[folder], work_dir, compress=compress, timeout=timeout, dump=phase_dump, seed=seed,
+                              profile=profile and phase == 1, sim=sim, trace_dir=trace_dir if phase == 1 else None, testcase=testcase,
+                              log_dir=phase_logs, latency=latency and phase == 1)
+            # Verilator's coverage was all collected in the first pass
+            cdd_path = score_seed(merger, result, archive_dir, tracker) if phase == 1 or sim != "verilator" else None
+            if phase == 1:
+                db.add_seed(result["test"], result["seed"], result["status"], result["duration"], result["sim_ns"], cdd_path)
+            busy[worker_idx] += time.monotonic() - task_start
+            completed[worker_idx] += 1
+            with log_lock:
+                index.write(json.dumps({"test": result["test"], "seed": result["seed"], "phase": phase, "status": result["status"],
+                                        "duration": round(result["duration"], 3), "log": result["log"]}) + "\n")
+                index.flush()
+                if phase_dump[0]:
+                    dump_bytes.append(result["dump_bytes"])
+                if phase == 2:
+                    reruns[task] = result["status"]
+                else:
+                    (passed_tasks if result["status"] == "PASS" else failed_tasks).append(task)
+                    statuses[result["status"]] = statuses.get(result["status"], 0) + 1
+                    test_result = test_statuses.setdefault(result["test"], {"wall_s": 0.0})
+                    test_result[result["status"]] = test_result.get(result["status"], 0) + 1
+                    test_result["wall_s"] += result["duration"]
+                    profiles.extend(result["profiles"])
+                    latencies.extend(result["latencies"])
+                pbar.set_postfix_str(f"{result['desc']} {result['status']}")
+                pbar.update(1)
+
+    def run_phase(task_list, phase, desc):
+        # Queue every task, workers take the next one as soon as they are free
+        tasks = queue.Queue()
+        for task in task_list:
+            tasks.put(task)
+        with tqdm(total=len(task_list), desc=desc, leave=True) as pbar:
+            workers = [threading.Thread(target=worker, args=(idx, pbar, tasks, phase))
+                       for idx in range(min(num_workers, len(task_list)))]
+            for thread in workers:
+                thread.start()
+            for thread in workers:
+                thread.join()
+
+    start = time.monotonic()
+    run_phase(task_list, 1, "Regression")
+    if two_phase:
+        # Every failing seed, and for covered a sample of the passing ones, again with waves
+        sampled = random.sample(passed_tasks, min(wave_sample, len(passed_tasks))) if sim != "verilator" else []
+        print(f"Rerunning {len(failed_tasks)} failing and {len(sampled)} sampled seeds with waves")
+        if failed_tasks or sampled:
+            run_phase(sorted(failed_tasks + sampled, key=expected_duration, reverse=True), 2, "Waves")
+    wall = time.monotonic() - start
+    db.close()
+    index.close()
 
     print("All tests finished!")
-    merge_coverage(work_dir="cov", merged_cov_file="merged.cdd")
+    if tracker and tracker.flat.is_set():
+        print(f"Stopped after {len(passed_tasks) + len(failed_tasks)} of {num_tasks} seeds, no new coverage in the last {tracker.window}")
+    print(f"Results: {statuses}")
+    print_test_results(test_statuses)
+    if two_phase:
+        # A seed that fails without waves and passes with them is worth a look
+        passed_on_rerun = sum(reruns.get(task) == "PASS" for task in failed_tasks)
+        print(f"Reruns with waves: {len(reruns)}, {sum(status != 'PASS' for status in reruns.values())} failed, "
+              f"{passed_on_rerun} of the {len(failed_tasks)} failing seeds passed")
+        if sim != "verilator":
+            print(f"Coverage is scored from the {len(reruns)} reruns only")
+    if dump_bytes:
+        print(f"Waves: {sum(dump_bytes) / len(dump_bytes):.0f} bytes per seed, {sum(dump_bytes)} in total")
+    print_utilisation(busy, completed, wall)
+    if profiles:
+        tests = aggregate_profiles(profiles)
+        print_profiles(tests)
+        with open("profile.json", "w") as f:
+            json.dump(tests, f, indent=1)
+    if latency:
+        # Every test's latency histograms, merged and compared with test/latency.py
+        with open("latency.jsonl", "w") as f:
+            f.writelines(json.dumps(record) + "\n" for record in latencies)
+        print(f"{len(latencies)} latency records written to latency.jsonl")
+
+    # Only the scoring still in flight and one .cdd per tree level are left
+    start = time.monotonic()
+    merger.finish(merged_cov_file=f"merged.{merger.extension}")
+    print(f"Coverage finished {time.monotonic() - start:.1f}s after the last test")
+    if tracker:
+        print(f"Merged coverage: {tracker.summary()}")
+    return statuses
+
+def print_test_results(tests):
+    # Outcomes of each test function over every seed it ran with
+    print("Results per test:")
+    print(f"  {'test':<32} {'pass':>6} {'fail':>6} {'timeout':>7} {'mean(s)':>8}")
+    for name, test in sorted(tests.items(), key=lambda item: -item[1]["wall_s"]):
+        runs = sum(count for status, count in test.items() if status != "wall_s")
+        print(f"  {name:<32} {test.get('PASS', 0):>6} {test.get('FAIL', 0):>6} {test.get('TIMEOUT', 0):>7} "
+              f"{test['wall_s'] / max(runs, 1):>8.1f}")
+
+def read_seeds(path):
+    # One seed per line, # starts a comment
+    with open(path) as f:
+        return [int(line.split("#")[0]) for line in f if line.split("#")[0].strip()]
+
+def write_seeds(path, seeds, comment):
+    with open(path, "w") as f:
+        f.write(f"# {comment}\n")
+        f.writelines(f"{seed}\n" for seed in seeds)
+
+def print_utilisation(busy, completed, wall):
+    # Busy time is time spent running tasks, everything else is idle
+    print(f"Worker utilisation over {wall:.1f}s:")
+    print(f"  {'worker':>6} {'tasks':>6} {'busy(s)':>9} {'idle(s)':>9} {'util':>6}")
+    for idx, (busy_s, tasks_done) in enumerate(zip(busy, completed)):
+        print(f"  {idx:>6} {tasks_done:>6} {busy_s:>9.1f} {wall - busy_s:>9.1f} {100 * busy_s / max(wall, 1e-9):>5.0f}%")
+    print(f"  {'total':>6} {sum(completed):>6} {sum(busy):>9.1f} {wall * len(busy) - sum(busy):>9.1f} "
+          f"{100 * sum(busy) / max(wall * len(busy), 1e-9):>5.0f}%")
 
 def main():
-    latest_log_path = "latest_regress.log"
-    if os.path.exists(latest_log_path):
-        os.remove(latest_log_path)
-
     parser = argparse.ArgumentParser(description="Run make in folders with Makefile.")
-    parser.add_argument("-runs", type=int, default=1, help="Number of repetitions per folder")
-    parser.add_argument("-width", type=int, default=4, help="Number of threads to use")
+    parser.add_argument("-runs", type=int, default=1, help="Number of seeds, each runs every test function as its own task")
+    parser.add_argument("-width", type=int, default=None, help="Number of worker threads to use (default: CPU count)")
+    parser.add_argument("-cov_width", type=int, default=None, help="Number of coverage scoring processes (default: half the CPU count)")
+    parser.add_argument("-sim", choices=list(SIMULATORS), default="icarus", help="Simulator (verilator collects its own coverage)")
+    parser.add_argument("-threads", type=int, default=None, help="Threads per Verilator model")
+    parser.add_argument("-dump_format", choices=sorted(set(COVERED_DUMP_FORMATS) | set(VERILATOR_DUMP_FORMATS)), default=None,
+                        help="Waveform format (default: cheapest covered can score, none for verilator)")
+    parser.add_argument("-dump_scope", choices=["tb", "user_peripheral"], default=None, help="Waveform scope (default: the scored scope)")
+    parser.add_argument("-timeout", type=float, default=1800, help="Kill a test after this many seconds (0 to disable)")
     parser.add_argument("-clean", action="store_true", help="Clean before running tests")
     parser.add_argument("-verbose", action="store_true", help="Enable verbose coverage output")
+    parser.add_argument("-compress", type=int, default=1, help="Divide button hold times (in controller frames) by this factor")
+    parser.add_argument("-db", default="regress.db", help="SQLite database the results of every seed are added to")
+    parser.add_argument("-keep_cdd", action="store_true", help="Keep each seed's coverage database in cov/seeds")
+    parser.add_argument("-profile", action="store_true", help="Profile the tests, summarised here and in profile.json")
+    parser.add_argument("-latency", action="store_true", help="Measure press to register latency, every test's record goes to latency.jsonl")
+    parser.add_argument("-spi_trace", action="store_true", help="Trace the SPI register accesses of each seed to traces/<test>_<seed>.trace")
+    parser.add_argument("-two_phase", action="store_true",
+                        help="Run every seed without waves, then rerun the failing ones with waves on the same seed")
+    parser.add_argument("-wave_sample", type=int, default=0,
+                        help="With -two_phase, also rerun this many passing seeds with waves to score their coverage")
+    parser.add_argument("-seeds", default=None, help="Run the seeds listed in this file instead of random ones")
+    parser.add_argument("-until_flat", type=int, default=None, metavar="WINDOW",
+                        help="Stop once this many tasks in a row add no line, comb or toggle coverage (-runs is the limit)")
+    parser.add_argument("-cov_baseline", default=None, help="Fail if coverage is lower than in this coverage.json")
+    parser.add_argument("-min_seeds", default=None, help="Write a minimal set of seeds reaching the same coverage to this file")
 
     args = parser.parse_args()
+    if args.sim == "verilator":
+        if args.dump_format and args.dump_format not in VERILATOR_DUMP_FORMATS:
+            parser.error(f"Verilator dumps {' or '.join(VERILATOR_DUMP_FORMATS)}")
+        if args.until_flat or args.min_seeds:
+            parser.error("-until_flat and -min_seeds need covered reports, use -sim icarus")
+    elif args.dump_format and args.dump_format not in COVERED_DUMP_FORMATS:
+        parser.error(f"covered cannot score {args.dump_format}")
+    if args.two_phase and args.until_flat:
+        parser.error("-until_flat needs the coverage of every seed, which -two_phase only scores for the reruns")
+    if args.wave_sample and not (args.two_phase and args.sim == "icarus"):
+        parser.error("-wave_sample is for -two_phase with -sim icarus, Verilator scores every seed without waves")
 
     cov_dir = "cov"
+    work_dir = "work"
+    trace_dir = "traces" if args.spi_trace else None
+    log_dir = "logs"
     os.makedirs(cov_dir, exist_ok=True)
-   
+
     if args.clean:
-        print("Cleaning cov directory before tests starts")
+        print("Cleaning cov and work directories before tests starts")
         clean_cov_dir(cov_dir=cov_dir)
-
-    run_test(runs=args.runs, width=args.width, cov_dir=cov_dir)
-
-    report_coverage(cov_dir=cov_dir, cov_file="merged.cdd", verbose=args.verbose)
+        shutil.rmtree(work_dir, ignore_errors=True)
+        shutil.rmtree(os.path.join(cov_dir, "seeds"), ignore_errors=True)
+        shutil.rmtree("traces", ignore_errors=True)
+        shutil.rmtree(log_dir, ignore_errors=True)
+    os.makedirs(work_dir, exist_ok=True)
+    os.makedirs(log_dir, exist_ok=True)
+    if args.two_phase:
+        os.makedirs(os.path.join(log_dir, "waves"), exist_ok=True)
+    if trace_dir:
+        os.makedirs(trace_dir, exist_ok=True)
+
+    # Follow each seed's own coverage only when it is asked for, it costs a report per seed
+    tracker = CoverageTracker(window=args.until_flat) if args.until_flat or args.min_seeds else None
+
+    run_test(runs=args.runs, width=args.width, cov_dir=cov_dir, work_dir=work_dir, compress=args.compress, timeout=args.timeout or None, cov_width=args.cov_width,
+             dump_format=args.dump_format, dump_scope=args.dump_scope, db_path=args.db, keep_cdd=args.keep_cdd,
+             seeds=read_seeds(args.seeds) if args.seeds else None, tracker=tracker,
+             profile=args.profile, sim=args.sim, threads=args.threads, trace_dir=os.path.abspath(trace_dir) if trace_dir else None,
+             log_dir=os.path.abspath(log_dir), two_phase=args.two_phase, wave_sample=args.wave_sample,
+             latency=args.latency)
+
+    if args.min_seeds:
+        seeds = tracker.minimal_seeds()
+        write_seeds(args.min_seeds, seeds, f"{len(seeds)} of {len(tracker.missed)} seeds, {tracker.summary()}")
+        print(f"{len(seeds)} of {len(tracker.missed)} seeds reach the same coverage, written to {args.min_seeds}")
+
+    if args.sim == "verilator":
+        report_verilator_coverage(cov_dir=cov_dir, cov_file="merged.dat")
+    else:
+        report_coverage(cov_dir=cov_dir, cov_file="merged.cdd", verbose=args.verbose)
+
+    if args.cov_baseline:
+        difference = diff_reports(load_report(args.cov_baseline), load_report("coverage.json"))
+        print(f"Coverage against {args.cov_baseline}:")
+        print_diff(difference)
+        if any(delta["hit"] < 0 for delta in difference["total"].values()):
+            sys.exit("Coverage dropped below the baseline")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
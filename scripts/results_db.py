@@ -0,0 +1,130 @@
+import argparse
+import glob
+import hashlib
+import os
+import sqlite3
+import threading
+from datetime import datetime
+
+# One row per regression run and one per seed, kept across runs
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    run_id      INTEGER PRIMARY KEY AUTOINCREMENT,
+    timestamp   TEXT NOT NULL,
+    rtl_hash    TEXT NOT NULL,
+    test_hash   TEXT NOT NULL,
+    args        TEXT
+);
+CREATE TABLE IF NOT EXISTS seeds (
+    run_id      INTEGER NOT NULL REFERENCES runs(run_id),
+    test        TEXT NOT NULL,
+    seed        INTEGER NOT NULL,
+    rtl_hash    TEXT NOT NULL,
+    test_hash   TEXT NOT NULL,
+    status      TEXT NOT NULL,
+    wall_s      REAL,
+    sim_ns      REAL,
+    coverage    TEXT,
+    timestamp   TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS seeds_seed ON seeds(seed);
+CREATE INDEX IF NOT EXISTS seeds_run ON seeds(run_id);
+"""
+
+def content_hash(patterns):
+    # Hash of the contents of every file matching the glob patterns, in a stable order
+    digest = hashlib.sha256()
+    for path in sorted({p for pattern in patterns for p in glob.glob(pattern, recursive=True)}):
+        digest.update(os.path.basename(path).encode())
+        with open(path, "rb") as f:
+            digest.update(f.read())
+    return digest.hexdigest()[:16]
+
+def rtl_hash(src_dir):
+    return content_hash([f"{src_dir}/**/*.v", f"{src_dir}/**/*.sv"])
+
+def test_hash(test_dir):
+    return content_hash([f"{test_dir}/*.py", f"{test_dir}/*.v", f"{test_dir}/Makefile"])
+
+class ResultsDB:
+    # Thread-safe writer for the regression workers
+
+    def __init__(self, path="regress.db"):
+        self.path = path
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.executescript(SCHEMA)
+        self.run_id = None
+
+    def start_run(self, rtl, test, args=""):
+        self.rtl_hash, self.test_hash = rtl, test
+        with self.lock, self.conn:
+            cursor = self.conn.execute(
+                "INSERT INTO runs (timestamp, rtl_hash, test_hash, args) VALUES (?, ?, ?, ?)",
+                (datetime.now().isoformat(), rtl, test, args))
+            self.run_id = cursor.lastrowid
+        return self.run_id
+
+    def add_seed(self, test, seed, status, wall_s, sim_ns=None, coverage=None):
+        with self.lock, self.conn:
+            self.conn.execute(
+                "INSERT INTO seeds (run_id, test, seed, rtl_hash, test_hash, status, wall_s, sim_ns, coverage, timestamp) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (self.run_id, test, seed, self.rtl_hash, self.test_hash, status, wall_s, sim_ns, coverage,
+                 datetime.now().isoformat()))
+
+    def durations(self):
+        # Mean wall time of each test over its passing seeds, to schedule slow tests first
+        with self.lock:
+            return dict(self.conn.execute(
+                "SELECT test, AVG(wall_s) FROM seeds WHERE status = 'PASS' AND wall_s IS NOT NULL GROUP BY test").fetchall())
+
+    def close(self):
+        self.conn.close()
+
+def query_slowest(conn, limit):
+    return conn.execute(
+        "SELECT seed, test, status, wall_s, sim_ns, sim_ns / wall_s, timestamp FROM seeds "
+        "WHERE wall_s IS NOT NULL ORDER BY wall_s DESC LIMIT ?", (limit,)).fetchall()
+
+def query_flaky(conn, limit):
+    # Same seed, RTL and test content, but more than one outcome
+    return conn.execute(
+        "SELECT seed, test, rtl_hash, test_hash, COUNT(*), GROUP_CONCAT(DISTINCT status) FROM seeds "
+        "GROUP BY seed, test, rtl_hash, test_hash HAVING COUNT(DISTINCT status) > 1 "
+        "ORDER BY COUNT(*) DESC LIMIT ?", (limit,)).fetchall()
+
+def query_pass_rate(conn, limit):
+    return conn.execute(
+        "SELECT runs.run_id, runs.timestamp, runs.rtl_hash, COUNT(seeds.seed), "
+        "SUM(seeds.status = 'PASS'), 100.0 * SUM(seeds.status = 'PASS') / COUNT(seeds.seed) "
+        "FROM runs JOIN seeds ON seeds.run_id = runs.run_id "
+        "GROUP BY runs.run_id ORDER BY runs.run_id DESC LIMIT ?", (limit,)).fetchall()
+
+def print_rows(headers, rows):
+    rows = [["" if value is None else (f"{value:.1f}" if isinstance(value, float) else str(value)) for value in row] for row in rows]
+    widths = [max(len(str(h)), *(len(row[i]) for row in rows)) if rows else len(str(h)) for i, h in enumerate(headers)]
+    print("  ".join(f"{h:>{w}}" for h, w in zip(headers, widths)))
+    for row in rows:
+        print("  ".join(f"{value:>{w}}" for value, w in zip(row, widths)))
+
+def main():
+    parser = argparse.ArgumentParser(description="Query the regression results database.")
+    parser.add_argument("query", choices=["slowest", "flaky", "passrate"], help="Report to print")
+    parser.add_argument("-db", default="regress.db", help="Results database")
+    parser.add_argument("-n", type=int, default=20, help="Number of rows")
+    args = parser.parse_args()
+
+    if not os.path.exists(args.db):
+        parser.error(f"No results database at {args.db}")
+    conn = sqlite3.connect(args.db)
+
+    if args.query == "slowest":
+        print_rows(["seed", "test", "status", "wall_s", "sim_ns", "sim_ns/s", "timestamp"], query_slowest(conn, args.n))
+    elif args.query == "flaky":
+        print_rows(["seed", "test", "rtl", "tests", "runs", "statuses"], query_flaky(conn, args.n))
+    else:
+        print_rows(["run", "timestamp", "rtl", "seeds", "passed", "pass_%"], query_pass_rate(conn, args.n))
+
+if __name__ == "__main__":
+    main()
@@ -27,6 +27,12 @@ module NESTest_Top (
     input wire SNES_PMOD_Clk,     // PMOD IO6 ->  ui_in[3]
     input wire SNES_PMOD_Latch,   // PMOD IO5 ->  ui_in[4]
 
+    // NES polling control: from the registers at addresses 0x3 to 0x5
+    input wire [7:0] NES_Clk_Div,  // nes_clk half period in units of 8 clk cycles
+    input wire [7:0] NES_Interval, // idle time between frames in units of 4096 clk cycles
+    input wire NES_Manual,         // 1 = only poll the NES controller on request
+    input wire NES_Poll,           // request a frame
+
     // button states: to data_out[7:0] on address 0x0
     output wire A_out,
     output wire B_out,
@@ -65,7 +71,11 @@ module NESTest_Top (
         .up(nes_up),
         .down(nes_down),
         .left(nes_left),
-        .right(nes_right)
+        .right(nes_right),
+        .clk_div(NES_Clk_Div),
+        .interval(NES_Interval),
+        .manual(NES_Manual),
+        .poll(NES_Poll)
     );
 
     // SNES Controller signals
@@ -134,17 +144,26 @@ module NES_Reciever (
     output wire up,
     output wire down,
     output wire left,
-    output wire right  // output states of nes controller buttons
+    output wire right,  // output states of nes controller buttons
+
+    // polling control, from the peripheral's registers
+    input wire [7:0] clk_div,   // nes_clk half period in units of 8 clk cycles, 0 counts as 1
+    input wire [7:0] interval,  // idle time between frames in units of 4096 clk cycles
+    input wire manual,          // 1 = only start a frame on poll
+    input wire poll             // start a frame from idle
 );
 
-    // Timing constants (pre-computed for 64 MHz). Readjust based on clk freq
-    // 64 MHz * 12 us = 768 cycles
-    // 64 MHz * 6 us  = 384 cycles
-    localparam [10:0] LATCH_CYCLES = 11'd768; 
-    localparam [10:0] HALF_CLK_CYC = 11'd384;
+    // Polling rate of the current frame, taken from the inputs as the latch rises
+    // so a write during a frame takes effect from the next one
+    reg [7:0] clk_div_reg, interval_reg;
+
+    // Timing from the clock divider, the reset value of 96 gives
+    // 96 * 8 = 768 cycles = 12 us half period at 64 MHz, 24 us per bit
+    wire [11:0] HALF_CLK_CYC = {1'b0, (clk_div_reg == 0) ? 8'd1 : clk_div_reg, 3'b000};
+    wire [11:0] LATCH_CYCLES = {HALF_CLK_CYC[10:0], 1'b0};
 
     // FSM symbolic states
-    localparam [3:0] latch_en = 4'h0;  // assert latch for 12 us
+    localparam [3:0] latch_en = 4'h0;  // assert latch for two half periods
     localparam [3:0] read_A_wait = 4'h1;
     localparam [3:0] read_B = 4'h2;
     localparam [3:0] read_select  = 4'h3;
@@ -153,9 +172,10 @@ module NES_Reciever (
     localparam [3:0] read_down    = 4'h6;
     localparam [3:0] read_left    = 4'h7;
     localparam [3:0] read_right   = 4'h8;
+    localparam [3:0] idle         = 4'h9;  // wait for the interval or a poll
 
     // register to count clock cycles to time latch assertion, nes_clk state, and FSM state transitions	 
-    reg [10:0] count_reg, count_next;
+    reg [19:0] count_reg, count_next;
 
     // FSM state register, and button state regs
     reg [3:0] state_reg, state_next;
@@ -179,6 +199,8 @@ module NES_Reciever (
         right_reg  <= 0;
         nes_clk    <= 0;
         latch      <= 0;
+        clk_div_reg  <= 0;
+        interval_reg <= 0;
 
     end else begin
         count_reg  <= count_next;
@@ -193,226 +215,247 @@ module NES_Reciever (
         right_reg  <= right_next;
         nes_clk    <= nes_clk_next;
         latch      <= latch_next;
+
+        // latch_en raises the latch on its first cycle
+        if (state_reg == latch_en && count_reg == 0) begin
+            clk_div_reg  <= clk_div;
+            interval_reg <= interval;
+        end
     end
 
     // FSM next-state logic and data path
-    always @(posedge clk) begin
+    always @(*) begin
 
         // defaults
-        count_next  <= count_reg;
-        A_next      <= A_reg;
-        B_next      <= B_reg;
-        select_next <= select_reg;
-        start_next  <= start_reg;
-        up_next     <= up_reg;
-        down_next   <= down_reg;
-        left_next   <= left_reg;
-        right_next  <= right_reg;
-        state_next  <= state_reg;
+        latch_next   = 0;
+        nes_clk_next = 0;
+        count_next  = count_reg;
+        A_next      = A_reg;
+        B_next      = B_reg;
+        select_next = select_reg;
+        start_next  = start_reg;
+        up_next     = up_reg;
+        down_next   = down_reg;
+        left_next   = left_reg;
+        right_next  = right_reg;
+        state_next  = state_reg;
 
         case (state_reg)
 
             latch_en: begin
                 // assert latch pin
-                latch_next <= 1;
-                nes_clk_next <= 0;  // nes_clk state
+                latch_next = 1;
+                nes_clk_next = 0;  // nes_clk state
 
-                // count 12 us
+                // count the latch pulse, two half periods
                 if (count_reg < LATCH_CYCLES)
-                    count_next <= count_reg + 1;
+                    count_next = count_reg + 1;
 
-                // once 12 us passed
-                else if (count_reg == LATCH_CYCLES) begin
-                    latch_next <= 0;  // deassert latch pin
-                    count_next <= 0;  // reset latch_count
-                    state_next <= read_A_wait;  // go to read_A_wait state
+                // once the latch pulse is over
+                else if (count_reg >= LATCH_CYCLES) begin
+                    latch_next = 0;  // deassert latch pin
+                    count_next = 0;  // reset latch_count
+                    state_next = read_A_wait;  // go to read_A_wait state
                 end
             end
 
             read_A_wait: begin
 
-                nes_clk_next <= 0;  // nes_clk state
+                nes_clk_next = 0;  // nes_clk state
 
                 if (count_reg == 0) begin
-                    A_next <= data;  // read A
+                    A_next = data;  // read A
                 end
 
-                if (count_reg < HALF_CLK_CYC)  // count clk cycles for 6 us
-                count_next <= count_reg + 1;
+                if (count_reg < HALF_CLK_CYC)  // count clk cycles for a half period
+                count_next = count_reg + 1;
 
-                // once 6 us passed
-                else if (count_reg == HALF_CLK_CYC) begin
-                    count_next <= 0;  // reset latch_count
-                    state_next <= read_B;  // go to read_B state
+                // once the half period passed
+                else if (count_reg >= HALF_CLK_CYC) begin
+                    count_next = 0;  // reset latch_count
+                    state_next = read_B;  // go to read_B state
                 end
             end
 
             read_B: begin
 
-                // count clk cycles for 12 us
+                // count clk cycles for one bit, two half periods
                 if (count_reg < LATCH_CYCLES) begin
-                    count_next <= count_reg + 1;
+                    count_next = count_reg + 1;
                 end
 
                 // nes_clk state
                 if (count_reg <= HALF_CLK_CYC)
-                    nes_clk_next<= 1;
+                    nes_clk_next = 1;
 
                 else if (count_reg > HALF_CLK_CYC)
-                    nes_clk_next <= 0;
+                    nes_clk_next = 0;
 
                 // read B
                 if (count_reg == HALF_CLK_CYC)
-                    B_next <= data;
+                    B_next = data;
 
                 // state over
-                if (count_reg == LATCH_CYCLES) begin
-                    count_next <= 0;  // reset latch_count
-                    state_next <= read_select;  // go to read_select state
+                if (count_reg >= LATCH_CYCLES) begin
+                    count_next = 0;  // reset latch_count
+                    state_next = read_select;  // go to read_select state
                 end
             end
 
             read_select: begin
 
-                // count clk cycles for 12 us
+                // count clk cycles for one bit, two half periods
                 if (count_reg < LATCH_CYCLES)
-                    count_next <= count_reg + 1;
+                    count_next = count_reg + 1;
 
                 // nes_clk state
                 if (count_reg <= HALF_CLK_CYC)
-                    nes_clk_next <= 1;
+                    nes_clk_next = 1;
                 else if (count_reg > HALF_CLK_CYC)
-                    nes_clk_next <= 0;
+                    nes_clk_next = 0;
 
                 // read select
                 if (count_reg == HALF_CLK_CYC)
-                    select_next <= data;
+                    select_next = data;
 
                 // state over
-                if (count_reg == LATCH_CYCLES) begin
-                    count_next <= 0;  // reset latch_count
-                    state_next <= read_start;  // go to read_start state
+                if (count_reg >= LATCH_CYCLES) begin
+                    count_next = 0;  // reset latch_count
+                    state_next = read_start;  // go to read_start state
                 end
 
             end
 
             read_start: begin
-                // count clk cycles for 12 us
+                // count clk cycles for one bit, two half periods
                 if (count_reg < LATCH_CYCLES)
-                count_next <= count_reg + 1;
+                count_next = count_reg + 1;
 
                 // nes_clk state
                 if (count_reg <= HALF_CLK_CYC)
-                    nes_clk_next <= 1;
+                    nes_clk_next = 1;
                 else if (count_reg > HALF_CLK_CYC)
-                    nes_clk_next <= 0;
+                    nes_clk_next = 0;
 
                 // read start
                 if (count_reg == HALF_CLK_CYC)
-                    start_next <= data;
+                    start_next = data;
 
                 // state over
-                if (count_reg == LATCH_CYCLES) begin
-                    count_next <= 0;  // reset latch_count
-                    state_next <= read_up;  // go to read_up state
+                if (count_reg >= LATCH_CYCLES) begin
+                    count_next = 0;  // reset latch_count
+                    state_next = read_up;  // go to read_up state
                 end
             end
 
             read_up: begin
-                // count clk cycles for 12 us
+                // count clk cycles for one bit, two half periods
                 if (count_reg < LATCH_CYCLES)
-                    count_next <= count_reg + 1;
+                    count_next = count_reg + 1;
 
                 // nes_clk state
                 if (count_reg <= HALF_CLK_CYC)
-                    nes_clk_next <= 1;
+                    nes_clk_next = 1;
                 else if (count_reg > HALF_CLK_CYC)
-                    nes_clk_next <= 0;
+                    nes_clk_next = 0;
 
                 // read up
                 if (count_reg == HALF_CLK_CYC)
-                    up_next <= data;
+                    up_next = data;
 
                 // state over
-                if (count_reg == LATCH_CYCLES) begin
-                    count_next <= 0;  // reset latch_count
-                    state_next <= read_down;  // go to read_down state
+                if (count_reg >= LATCH_CYCLES) begin
+                    count_next = 0;  // reset latch_count
+                    state_next = read_down;  // go to read_down state
                 end
             end
 
             read_down: begin
-                // count clk cycles for 12 us
+                // count clk cycles for one bit, two half periods
                 if (count_reg < LATCH_CYCLES)
-                    count_next <= count_reg + 1;
+                    count_next = count_reg + 1;
 
                 // nes_clk state
                 if (count_reg <= HALF_CLK_CYC) begin
-                    nes_clk_next <= 1;
+                    nes_clk_next = 1;
                 end else if (count_reg > HALF_CLK_CYC) begin
-                    nes_clk_next <= 0;
+                    nes_clk_next = 0;
                 end
 
                 // read down
                 if (count_reg == HALF_CLK_CYC) begin
-                    down_next <= data;
+                    down_next = data;
                 end
 
                 // state over
-                if (count_reg == LATCH_CYCLES) begin
-                    count_next <= 0;  // reset latch_count
-                    state_next <= read_left;  // go to read_left state
+                if (count_reg >= LATCH_CYCLES) begin
+                    count_next = 0;  // reset latch_count
+                    state_next = read_left;  // go to read_left state
                 end
             end
 
             read_left: begin
-                // count clk cycles for 12 us
+                // count clk cycles for one bit, two half periods
                 if (count_reg < LATCH_CYCLES)
-                    count_next <= count_reg + 1;
+                    count_next = count_reg + 1;
 
                 // nes_clk state
                 if (count_reg <= HALF_CLK_CYC) begin
-                    nes_clk_next <= 1;
+                    nes_clk_next = 1;
                 end else if (count_reg > HALF_CLK_CYC) begin
-                    nes_clk_next <= 0;
+                    nes_clk_next = 0;
                 end
 
                 // read left
                 if (count_reg == HALF_CLK_CYC)
-                    left_next <= data;
+                    left_next = data;
 
                 // state over
-                if (count_reg == LATCH_CYCLES) begin
-                    count_next <= 0;  // reset latch_count
-                    state_next <= read_right;  // go to read_right state
+                if (count_reg >= LATCH_CYCLES) begin
+                    count_next = 0;  // reset latch_count
+                    state_next = read_right;  // go to read_right state
                 end
 
             end
 
             read_right: begin
-                // count clk cycles for 12 us
+                // count clk cycles for one bit, two half periods
                 if (count_reg < LATCH_CYCLES) begin
-                    count_next <= count_reg + 1;
+                    count_next = count_reg + 1;
                 end
 
                 // nes_clk state
                 if (count_reg <= HALF_CLK_CYC) begin
-                    nes_clk_next <= 1;
+                    nes_clk_next = 1;
                 end else if (count_reg > HALF_CLK_CYC) begin
-                    nes_clk_next <= 0;
+                    nes_clk_next = 0;
                 end
 
                 // read right
                 if (count_reg == HALF_CLK_CYC)
-                    right_next <= data;
+                    right_next = data;
 
                 // state over
-                if (count_reg == LATCH_CYCLES) begin
-                    count_next <= 0;  // reset latch_count
-                    state_next <= latch_en;  // go to latch_en state
+                if (count_reg >= LATCH_CYCLES) begin
+                    count_next = 0;  // reset latch_count
+                    // wait in idle if the frames are spaced out or polled
+                    if (manual || interval_reg != 0)
+                        state_next = idle;
+                    else
+                        state_next = latch_en;  // go to latch_en state
                 end
             end
 
-            default: state_next <= latch_en;  // default state
+            idle: begin
+                // latch and nes_clk stay low
+                if (poll || (!manual && count_reg[19:12] >= interval_reg)) begin
+                    count_next = 0;
+                    state_next = latch_en;  // start the next frame
+                end else
+                    count_next = count_reg + 1;
+            end
+
+            default: state_next = latch_en;  // default state
         endcase
     end
 
@@ -30,6 +30,11 @@ module tqvp_nes_snes_controller (
     wire [3:0] extra_snes_buttons;
     wire is_snes;
 
+    // NES polling control, written by the TinyQV core
+    reg [7:0] nes_ctrl;      // bit 0: manual polling, bit 1: poll request
+    reg [7:0] nes_clk_div;   // nes_clk half period in units of 8 clk cycles
+    reg [7:0] nes_interval;  // idle time between frames in units of 4096 clk cycles
+
     NESTest_Top nes_snes_module (
 
         // system
@@ -46,6 +51,12 @@ module tqvp_nes_snes_controller (
         .SNES_PMOD_Clk(ui_in[3]),     // PMOD IO6 ->  ui_in[3]
         .SNES_PMOD_Latch(ui_in[4]),   // PMOD IO5 ->  ui_in[4]
 
+        // NES polling control: from the registers at addresses 0x3 to 0x5
+        .NES_Clk_Div(nes_clk_div),
+        .NES_Interval(nes_interval),
+        .NES_Manual(nes_ctrl[0]),
+        .NES_Poll(nes_ctrl[1]),
+
         // button states: to data_out[7:0] on address 0x1
         .A_out(standard_buttons[7]),
         .B_out(standard_buttons[6]),
@@ -149,14 +160,69 @@ module tqvp_nes_snes_controller (
             end
         end
 
+    // Button change events: every latched frame that differs from the one before
+    // pushes {frame, ext buttons, std buttons} into a small FIFO read at 0x6/0x7
+    localparam [2:0] EVENT_DEPTH = 3'd4;
+
+    reg [15:0] event_fifo [0:3];
+    reg [1:0] event_head;
+    reg [1:0] event_tail;
+    reg [2:0] event_count;
+    reg [3:0] frame_count;
+
+    wire buttons_changed = enable_button_regs &&
+                           ({extra_snes_buttons, standard_buttons} != {ext_btn_reg[3:0], std_btn_reg});
+    wire event_pop  = data_write && (address == 4'h7) && (event_count != 0);
+    wire event_push = buttons_changed && ((event_count != EVENT_DEPTH) || event_pop);
+    wire [2:0] event_count_next = event_count + {2'b00, event_push} - {2'b00, event_pop};
+
+    // oldest event, 0 when the FIFO is empty
+    wire [15:0] event_entry   = (event_count != 0) ? event_fifo[event_head] : 16'h0000;
+    wire [7:0]  event_buttons = event_entry[7:0];
+    wire [7:0]  event_info    = event_entry[15:8];
+
+    always @(posedge clk) begin
+        if (~rst_n) begin
+            event_head  <= 2'd0;
+            event_tail  <= 2'd0;
+            event_count <= 3'd0;
+            frame_count <= 4'd0;
+        end else begin
+            if (enable_button_regs)
+                frame_count <= frame_count + 1;
+
+            if (event_push) begin
+                event_fifo[event_tail] <= {frame_count, extra_snes_buttons, standard_buttons};
+                event_tail <= event_tail + 1;
+            end
+
+            if (event_pop)
+                event_head <= event_head + 1;
+
+            event_count <= event_count_next;
+        end
+    end
+
     always @(posedge clk ) begin
         if (~rst_n) begin
             std_btn_reg <= 8'b0;
             ext_btn_reg <= 8'b0;
             status_reg <= 8'b0;
         end else begin
-            status_reg  <= {7'b0000000, is_snes};
-           
+            // bit 0: is_snes, bit 1: buttons changed, bit 2: event lost, bits 6:4: events queued
+            status_reg[0]   <= is_snes;
+            status_reg[3]   <= 1'b0;
+            status_reg[6:4] <= event_count_next;
+            status_reg[7]   <= 1'b0;
+
+            // the changed and overflow flags are sticky, writing 1 clears them
+            if (data_write && (address == 4'h2))
+                status_reg[2:1] <= status_reg[2:1] & ~data_in[2:1];
+            if (buttons_changed)
+                status_reg[1] <= 1'b1;
+            if (buttons_changed && !event_push)
+                status_reg[2] <= 1'b1;
+
             if (enable_button_regs) begin // refresh at the end of a complete cycle
                 std_btn_reg <= standard_buttons;
                 ext_btn_reg <= {4'b0000, extra_snes_buttons};
@@ -164,12 +230,40 @@ module tqvp_nes_snes_controller (
         end
     end
 
+    // NES polling control registers. A poll request stays set until the
+    // requested frame raises the latch, writing 0 to it has no effect. A write
+    // while the latch is high does not keep the old request alive.
+    always @(posedge clk) begin
+        if (~rst_n) begin
+            nes_ctrl     <= 8'h00;
+            nes_clk_div  <= 8'd96;  // 12 us half period, as before it was programmable
+            nes_interval <= 8'h00;
+        end else begin
+            if (uo_out[6])
+                nes_ctrl[1] <= 1'b0;
+
+            if (data_write) begin
+                case (address)
+                    4'h3: nes_ctrl     <= {6'b000000, (nes_ctrl[1] & ~uo_out[6]) | data_in[1], data_in[0]};
+                    4'h4: nes_clk_div  <= data_in;
+                    4'h5: nes_interval <= data_in;
+                    default: ;
+                endcase
+            end
+        end
+    end
+
     assign uo_out[5:0] = 6'b000000;
 
     //  BUG: TT-RV-0001 - NO_INVERT
     assign data_out = (address == 4'h0) ? std_btn_reg :
                       (address == 4'h1) ? ext_btn_reg :
                       (address == 4'h2) ? status_reg  :
+                      (address == 4'h3) ? nes_ctrl    :
+                      (address == 4'h4) ? nes_clk_div :
+                      (address == 4'h5) ? nes_interval :
+                      (address == 4'h6) ? event_buttons :
+                      (address == 4'h7) ? event_info   :
                       8'h0;
 
 endmodule
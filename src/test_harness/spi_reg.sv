@@ -5,7 +5,10 @@
 
 module spi_reg #(
     parameter int ADDR_W = 3,
-    parameter int REG_W = 8
+    parameter int REG_W = 8,
+    // Burst mode - keep spi_cs_n low after a data byte to start the next
+    // command/address byte straight away, without a new start of frame
+    parameter bit BURST = 1'b0
 ) (
     input  logic clk,
     input  logic rstb,
@@ -115,7 +118,7 @@ module spi_reg #(
       STATE_RX_DATA : begin
         if (buffer_counter == 4'd8) begin
           sample_data = 1'b1;
-          next_state = STATE_IDLE;
+          next_state = BURST ? STATE_ADDR : STATE_IDLE;
         end else if (eof == 1'b1) begin
           next_state = STATE_IDLE;
         end
@@ -124,7 +127,7 @@ module spi_reg #(
         if (buffer_counter == 4'd0) begin
           tx_buffer_load = 1'b1;
         end else if (buffer_counter == 4'd8) begin
-          next_state = STATE_IDLE;
+          next_state = BURST ? STATE_ADDR : STATE_IDLE;
         end else if (eof == 1'b1) begin
           next_state = STATE_IDLE;
         end
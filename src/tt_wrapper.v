@@ -65,8 +65,8 @@ module tt_um_tqv_peripheral_harness (
   synchronizer #(.STAGES(2), .WIDTH(1)) synchronizer_spi_clk_inst  (.clk(clk), .data_in(spi_clk),  .data_out(spi_clk_sync));
   synchronizer #(.STAGES(2), .WIDTH(1)) synchronizer_spi_mosi_inst (.clk(clk), .data_in(spi_mosi), .data_out(spi_mosi_sync));  
 
-  // The SPI instance
-  spi_reg #(.ADDR_W(4)) i_spi_reg(
+  // The SPI instance, in burst mode so several registers can be accessed in one frame
+  spi_reg #(.ADDR_W(4), .BURST(1'b1)) i_spi_reg(
     .clk(clk),
     .rstb(rst_reg_n),
     .ena(1'b1),
@@ -0,0 +1,111 @@
+# SPDX-FileCopyrightText: © 2025 Tiny Tapeout
+# SPDX-License-Identifier: Apache-2.0
+
+# Benchmarks for the verification stack, run with:
+#   make MODULE=bench
+# BENCH_RESULTS=<file> also writes the metrics as JSON, see ../bench/run_bench.py
+
+import json
+import os
+import time
+import cocotb
+
+from cocotb.clock import Clock
+from cocotb.triggers import ClockCycles, RisingEdge
+from cocotb.utils import get_sim_time
+from nes import NES_Controller
+from tqv import TinyQV
+
+PERIPHERAL_NUM = 16
+
+BENCH_REGS = [0, 1, 2]
+BENCH_ITERATIONS = 20
+BENCH_MODEL_FRAMES = 20000
+BENCH_SIM_FRAMES = 20
+BENCH_RESULTS = os.environ.get("BENCH_RESULTS")
+
+def record(name, value, unit):
+    # Add a metric to the BENCH_RESULTS file, higher values are better
+    if not BENCH_RESULTS:
+        return
+    results = {}
+    if os.path.exists(BENCH_RESULTS):
+        with open(BENCH_RESULTS) as f:
+            results = json.load(f)
+    results[name] = {"value": value, "unit": unit, "higher_is_better": True}
+    with open(BENCH_RESULTS, "w") as f:
+        json.dump(results, f, indent=1)
+
+async def bench_setup(dut):
+    tqv = TinyQV(dut, PERIPHERAL_NUM)
+    clock = Clock(dut.clk, 16, units="ns")
+    cocotb.start_soon(clock.start())
+    await tqv.reset()
+    await ClockCycles(dut.clk, 10)
+    return tqv
+
+def report(dut, name, regs, sim_ns, wall_s):
+    dut._log.info(f"{name:<14} {sim_ns / regs:10.1f} sim-ns/reg {wall_s * 1e6 / regs:10.1f} wall-us/reg")
+    record(f"spi_{name.replace(' ', '_')}", regs / wall_s, "transactions/wall-s")
+
+@cocotb.test()
+async def bench_spi_burst(dut):
+    tqv = await bench_setup(dut)
+    regs = len(BENCH_REGS) * BENCH_ITERATIONS
+
+    # Single frame per register
+    sim_start, wall_start = get_sim_time("ns"), time.perf_counter()
+    single = []
+    for _ in range(BENCH_ITERATIONS):
+        single.append([await tqv.read_reg(reg) for reg in BENCH_REGS])
+    report(dut, "single read", regs, get_sim_time("ns") - sim_start, time.perf_counter() - wall_start)
+
+    # One burst frame for all registers
+    sim_start, wall_start = get_sim_time("ns"), time.perf_counter()
+    burst = []
+    for _ in range(BENCH_ITERATIONS):
+        burst.append(await tqv.read_regs(BENCH_REGS))
+    report(dut, "burst read", regs, get_sim_time("ns") - sim_start, time.perf_counter() - wall_start)
+
+    assert single == burst, f"Burst read mismatch: single={single[-1]}, burst={burst[-1]}"
+
+    # Writing 0 to the button and status registers changes nothing, but still costs a full transaction
+    sim_start, wall_start = get_sim_time("ns"), time.perf_counter()
+    for _ in range(BENCH_ITERATIONS):
+        for reg in BENCH_REGS:
+            await tqv.write_reg(reg, 0)
+    report(dut, "single write", regs, get_sim_time("ns") - sim_start, time.perf_counter() - wall_start)
+
+    sim_start, wall_start = get_sim_time("ns"), time.perf_counter()
+    for _ in range(BENCH_ITERATIONS):
+        await tqv.write_regs({reg: 0 for reg in BENCH_REGS})
+    report(dut, "burst write", regs, get_sim_time("ns") - sim_start, time.perf_counter() - wall_start)
+
+@cocotb.test()
+async def bench_nes_model(dut):
+    tqv = await bench_setup(dut)
+    nes = NES_Controller(dut)
+    nes.press("B")
+    nes.press("Up")
+
+    # Model only: latch and shift out a full frame without waiting on the simulator
+    wall_start = time.perf_counter()
+    for _ in range(BENCH_MODEL_FRAMES):
+        nes.latch()
+        for _ in range(7):
+            dut.nes_data.value = nes.shift()
+    wall_s = time.perf_counter() - wall_start
+    dut._log.info(f"nes model      {BENCH_MODEL_FRAMES / wall_s:10.0f} frames/wall-s")
+    record("nes_model", BENCH_MODEL_FRAMES / wall_s, "frames/wall-s")
+
+    # In simulation: the model following the receiver's latch and clock
+    cocotb.start_soon(nes.model_nes())
+    await RisingEdge(dut.nes_latch)
+    sim_start, wall_start = get_sim_time("ns"), time.perf_counter()
+    for _ in range(BENCH_SIM_FRAMES):
+        await RisingEdge(dut.nes_latch)
+    sim_ns, wall_s = get_sim_time("ns") - sim_start, time.perf_counter() - wall_start
+    dut._log.info(f"nes simulated  {BENCH_SIM_FRAMES / wall_s:10.1f} frames/wall-s {sim_ns / wall_s:10.0f} sim-ns/wall-s")
+    record("nes_simulated", BENCH_SIM_FRAMES / wall_s, "frames/wall-s")
+
+    assert await tqv.read_reg(0) == 0b01001000, "B and Up should be pressed"
@@ -0,0 +1,248 @@
+#!/usr/bin/env python3
+# Press to register latency of the controller models, opt-in with LATENCY=1.
+#
+# The models timestamp every button press, and the monitor follows each frame the
+# peripheral loads into std_btn_reg/ext_btn_reg: a press is done once its bit is in
+# the registers. Every test appends a JSON record to LATENCY_FILE with a histogram
+# in clock cycles per controller type, this file also merges and compares them:
+#
+#   python latency.py latency.jsonl [-baseline latency.json] [-save latency.json]
+
+import argparse
+import json
+import math
+import os
+import sys
+
+import cocotb
+from cocotb.triggers import FallingEdge, ReadOnly
+from cocotb.utils import get_sim_time
+
+# Opt-in with LATENCY=1, the monitor does nothing without it
+LATENCY = os.environ.get("LATENCY", "0") not in ("", "0")
+
+# One JSON record per test is appended here, relative to the simulator's directory
+LATENCY_FILE = os.environ.get("LATENCY_FILE", "latency.jsonl")
+
+# Percentiles reported, as (name, fraction)
+PERCENTILES = [("min", 0.0), ("median", 0.5), ("p99", 0.99), ("max", 1.0)]
+
+def percentile(histogram, fraction):
+    # Nearest rank percentile of a {cycles: count} histogram
+    rank = max(1, math.ceil(fraction * sum(histogram.values())))
+    seen = 0
+    for cycles in sorted(histogram):
+        seen += histogram[cycles]
+        if seen >= rank:
+            return cycles
+    return None
+
+def summarise(histogram, period_ns):
+    # Percentiles in clock cycles and us
+    summary = {"presses": sum(histogram.values())}
+    if histogram:
+        for name, fraction in PERCENTILES:
+            cycles = percentile(histogram, fraction)
+            summary[name] = cycles
+            summary[f"{name}_us"] = cycles * period_ns / 1000
+    return summary
+
+class Presses:
+
+    # Presses of one controller type: pending ones as {register bit: press time in ps}
+    # and the latency of the ones seen in the registers as {cycles: count}
+    __slots__ = ("bits", "state", "pending", "histogram", "dropped")
+
+    def __init__(self, controller):
+        self.bits = {}
+        for mask in controller.BUTTON_MASKS.values():
+            registers = controller.registers(mask)
+            std_btn, ext_btn = registers if isinstance(registers, tuple) else (registers, 0)
+            self.bits[mask] = (std_btn << 8) | ext_btn
+        self.state = 0
+        self.pending = {}
+        self.histogram = {}
+        # Released before a frame showed them, or dropped by the PMOD decoder
+        self.dropped = 0
+
+class LatencyMonitor:
+
+    # Measures every press of the given controller models (NES_Controller and
+    # SNES_Controller) from the time the model's button state changes to the clock
+    # edge that loads its bit into std_btn_reg or ext_btn_reg.
+
+    def __init__(self, dut, test, *controllers, period_ns=16):
+        self.dut = dut
+        self.test = test
+        self.period_ns = period_ns
+        self.period = int(period_ns * 1000)
+        self.task = None
+        self.kinds = {}
+        if not LATENCY:
+            return
+        for controller in controllers:
+            controller.latency = self
+            self.kinds[self.kind(controller)] = Presses(controller)
+
+    @staticmethod
+    def kind(controller):
+        return type(controller).__name__.split("_")[0]
+
+    # Start following the register updates once the design is out of reset
+    async def start(self):
+        if LATENCY:
+            self.task = cocotb.start_soon(self.monitor())
+
+    # Called by a model whenever its button state changes
+    def buttons(self, controller, state):
+        presses = self.kinds[self.kind(controller)]
+        # A disconnected PMOD reports all ones, no buttons are pressed
+        if state == getattr(controller, "DISCONNECTED", None):
+            state = 0
+        changed = state ^ presses.state
+        if not changed:
+            return
+        now = int(round(get_sim_time("ps")))
+        for mask, bit in presses.bits.items():
+            if not changed & mask:
+                continue
+            if state & mask:
+                presses.pending[bit] = now
+            elif presses.pending.pop(bit, None) is not None:
+                presses.dropped += 1
+        presses.state = state
+
+    async def monitor(self):
+        regs = self.dut.test_harness.user_peripheral
+        # The registers load on the clock edge that clears enable_button_regs
+        loaded = FallingEdge(regs.enable_button_regs)
+        read_only = ReadOnly()
+        # The first frame after reset reports the receivers' reset values
+        await loaded
+        while True:
+            await loaded
+            await read_only
+            kind = "SNES" if regs.status_reg.value.integer & 1 else "NES"
+            self.update(kind, int(round(get_sim_time("ps"))),
+                        (regs.std_btn_reg.value.integer << 8) | regs.ext_btn_reg.value.integer)
+
+    def update(self, kind, now, registers):
+        presses = self.kinds.get(kind)
+        if presses is None or not presses.pending:
+            return
+        histogram = presses.histogram
+        for bit, pressed in list(presses.pending.items()):
+            if registers & bit:
+                del presses.pending[bit]
+                cycles = (now - pressed) // self.period
+                histogram[cycles] = histogram.get(cycles, 0) + 1
+
+    # Stop the monitor, log the latencies and append them to LATENCY_FILE
+    def finish(self):
+        if not LATENCY:
+            return None
+        if self.task is not None:
+            self.task.kill()
+            self.task = None
+        record = self.record()
+        for kind, entry in record["controllers"].items():
+            self.dut._log.info(f"{kind} latency: {format_summary(entry)}")
+        with open(LATENCY_FILE, "a") as f:
+            f.write(json.dumps(record) + "\n")
+        return record
+
+    def record(self):
+        controllers = {}
+        for kind, presses in self.kinds.items():
+            entry = summarise(presses.histogram, self.period_ns)
+            entry["dropped"] = presses.dropped
+            entry["pending"] = len(presses.pending)
+            entry["histogram"] = {str(cycles): count for cycles, count in sorted(presses.histogram.items())}
+            controllers[kind] = entry
+        return {"test": self.test, "seed": cocotb.RANDOM_SEED, "period_ns": self.period_ns, "controllers": controllers}
+
+def format_summary(entry):
+    if not entry["presses"]:
+        return f"no presses seen, {entry['dropped']} dropped"
+    return (f"{entry['presses']} presses, min/median/p99 {entry['min']}/{entry['median']}/{entry['p99']} cycles "
+            f"({entry['min_us']:.2f}/{entry['median_us']:.2f}/{entry['p99_us']:.2f} us), {entry['dropped']} dropped")
+
+def merge(records):
+    # Histograms per controller type over every record, e.g. every seed of a regression
+    merged = {}
+    period_ns = None
+    for record in records:
+        if period_ns is not None and record["period_ns"] != period_ns:
+            raise ValueError("Latency records with different clock periods cannot be merged")
+        period_ns = record["period_ns"]
+        for kind, entry in record["controllers"].items():
+            totals = merged.setdefault(kind, {"histogram": {}, "dropped": 0, "pending": 0})
+            for cycles, count in entry["histogram"].items():
+                totals["histogram"][int(cycles)] = totals["histogram"].get(int(cycles), 0) + count
+            totals["dropped"] += entry["dropped"]
+            totals["pending"] += entry["pending"]
+    result = {}
+    for kind, totals in merged.items():
+        entry = summarise(totals["histogram"], period_ns)
+        entry["dropped"] = totals["dropped"]
+        entry["pending"] = totals["pending"]
+        entry["histogram"] = {str(cycles): count for cycles, count in sorted(totals["histogram"].items())}
+        result[kind] = entry
+    return {"period_ns": period_ns, "records": len(records), "controllers": result}
+
+def print_histogram(histogram, bins=16, width=50):
+    # Text histogram with at most `bins` rows of equal width in cycles
+    histogram = {int(cycles): count for cycles, count in histogram.items()}
+    low, high = min(histogram), max(histogram)
+    step = max(1, math.ceil((high - low + 1) / bins))
+    rows = {}
+    for cycles, count in histogram.items():
+        start = low + (cycles - low) // step * step
+        rows[start] = rows.get(start, 0) + count
+    most = max(rows.values())
+    for start in range(low, high + 1, step):
+        count = rows.get(start, 0)
+        print(f"  {start:>8}-{start + step - 1:<8} {count:>8} {'#' * math.ceil(width * count / most)}")
+
+def compare(baseline, merged, threshold):
+    # Controller types whose median or p99 latency grew by more than threshold
+    regressed = []
+    for kind, entry in merged["controllers"].items():
+        base = baseline["controllers"].get(kind)
+        if base is None or not base["presses"] or not entry["presses"]:
+            continue
+        for name in ("median", "p99"):
+            change = (entry[name] - base[name]) / max(base[name], 1)
+            flag = "  REGRESSED" if change > threshold else ""
+            print(f"{kind:<5} {name:<7} {base[name]:>10} {entry[name]:>10} cycles {100 * change:>+7.1f}%{flag}")
+            if flag:
+                regressed.append(f"{kind} {name}")
+    return regressed
+
+def main():
+    parser = argparse.ArgumentParser(description="Merge and compare press to register latency records.")
+    parser.add_argument("records", help="Records written with LATENCY=1, e.g. latency.jsonl")
+    parser.add_argument("-save", default=None, help="Write the merged latencies to this JSON file")
+    parser.add_argument("-baseline", default=None, help="Fail if the median or p99 latency grew against this merged JSON file")
+    parser.add_argument("-threshold", type=float, default=0.0, help="Relative growth allowed against the baseline")
+    args = parser.parse_args()
+
+    with open(args.records) as f:
+        merged = merge([json.loads(line) for line in f if line.strip()])
+    print(f"Latency over {merged['records']} tests, {merged['period_ns']} ns clock:")
+    for kind, entry in merged["controllers"].items():
+        print(f"{kind}: {format_summary(entry)}")
+        if entry["presses"]:
+            print_histogram(entry["histogram"])
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(merged, f, indent=1)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressed = compare(json.load(f), merged, args.threshold)
+        if regressed:
+            sys.exit(f"Latency regressed: {', '.join(regressed)}")
+
+if __name__ == "__main__":
+    main()
@@ -1,81 +1,130 @@
 import random
 import cocotb
 from cocotb import logging
-from cocotb.triggers import RisingEdge
+from cocotb.triggers import Edge, FallingEdge, RisingEdge
+from profiling import profiled
 
 class NES_Controller:
 
     # NES controller button order: A, B, Select, Start, Up, Down, Left, Right
     BUTTONS = ["A", "B", "Select", "Start", "Up", "Down", "Left", "Right"]
 
+    # Mask of each button in the button and shift registers, A is shifted out first
+    BUTTON_MASKS = {btn: 1 << i for i, btn in enumerate(BUTTONS)}
+
+    # Controller latch and clock pins on uo_out, see tb.v
+    LATCH_BIT = 6
+    CLK_BIT = 7
+
+    __slots__ = ("dut", "id", "log", "_buttons", "shift_register", "latency")
+
     def __init__(self, dut):
         self.dut = dut
         global_nes_controller_id = getattr(NES_Controller, "global_id", 0)
         self.id = global_nes_controller_id
         NES_Controller.global_id = global_nes_controller_id + 1
         self.log = logging.getLogger(f"cocotb.tb.nes_controller_{self.id}")
-        self.log.setLevel("INFO")  # Optional: set log level per class
-        self.button_states = {btn: False for btn in self.BUTTONS}
-        self.shift_register = [0] * 8
-        self.shift_index = 0
+        self.log.setLevel("INFO")  # Optional: set log level per class, DEBUG traces every edge
+        self.latency = None
+        self.reset()
 
     def reset(self):
-        self.button_states = {btn: False for btn in self.BUTTONS}
-        self.shift_register = [0] * 8
-        self.shift_index = 0
+        # Pressed buttons, one bit per button
+        self._buttons = 0
+        # Shift register as seen on the data line (active low), bit 0 is the current output
+        self.shift_register = 0xFF
+
+    @property
+    def buttons(self):
+        return self._buttons
+
+    @buttons.setter
+    def buttons(self, state):
+        # The latency monitor timestamps the presses, see latency.py
+        if self.latency is not None:
+            self.latency.buttons(self, state)
+        self._buttons = state
+
+    @property
+    def button_states(self):
+        return {btn: bool(self.buttons & mask) for btn, mask in self.BUTTON_MASKS.items()}
 
     def press(self, button=None):
         if button is None:
             button = random.choice(self.BUTTONS)
-            self.log.info(f"pressing random button: {button}")
-            self.button_states[button] = True
-        elif button in self.BUTTONS:
-            self.log.info(f"pressing button: {button}")
-            self.button_states[button] = True
-       
+            self.log.info("pressing random button: %s", button)
+            self.buttons |= self.BUTTON_MASKS[button]
+        elif button in self.BUTTON_MASKS:
+            self.log.info("pressing button: %s", button)
+            self.buttons |= self.BUTTON_MASKS[button]
+
         return button
 
     def release(self, button):
-        if button in self.BUTTONS:
-            self.log.info(f"releasing button: {button}")
-            self.button_states[button] = False
+        if button in self.BUTTON_MASKS:
+            self.log.info("releasing button: %s", button)
+            self.buttons &= ~self.BUTTON_MASKS[button]
+
+    # The std_btn_reg value the peripheral reports for a button state, A is the MSB
+    @classmethod
+    def registers(cls, buttons):
+        std_btn = 0
+        for i in range(len(cls.BUTTONS)):
+            std_btn = (std_btn << 1) | ((buttons >> i) & 1)
+        return std_btn
 
     # modelling methods
     @cocotb.coroutine
     async def model_nes(self):
-        cocotb.start_soon(self.nes_latch())
-        cocotb.start_soon(self.nes_shift())
+        cocotb.start_soon(self.nes_model())
 
-    # model the NES latch behavior
-    @cocotb.coroutine
-    async def nes_latch(self):
+    # Latch one button state per controller frame, taken from states (any iterator, so
+    # long schedules are never built up front). Needs the model running, see model_nes.
+    # Each state is set while the latch is low, so the next rising latch takes it.
+    async def run(self, states):
+        latch_rise = RisingEdge(self.dut.nes_latch)
+        latch_fall = FallingEdge(self.dut.nes_latch)
+        for state in states:
+            if self.dut.nes_latch.value:
+                await latch_fall
+            self.buttons = state
+            await latch_rise
+
+    # model the NES latch and shift behavior from one loop on the controller pins
+    async def nes_model(self):
+        pins = self.dut.uo_out
+        pins_changed = Edge(pins)
+        latch_mask = 1 << self.LATCH_BIT
+        clk_mask = 1 << self.CLK_BIT
+        prev = 0
         while True:
-            await RisingEdge(self.dut.nes_latch)
-            self.latch()
+            await pins_changed
+            value = pins.value
+            if not value.is_resolvable:
+                continue
+            value = value.integer
+            rising = value & ~prev
+            prev = value
+            if rising & latch_mask:
+                self.latch()
+            elif rising & clk_mask:
+                data_val = self.shift()
+                if self.log.isEnabledFor(logging.DEBUG):
+                    self.log.debug("shifting nes clk: output: %d", data_val)
+                self.dut.nes_data.value = data_val
 
+    @profiled
     def latch(self):
         # Latch button states into shift register
-        self.shift_register = [int(not self.button_states[btn]) for btn in self.BUTTONS]
-        self.shift_index = 0
-        data_val = self.shift_register[self.shift_index]
-        self.log.info(f"latching nes latch: output: {data_val}")
+        self.shift_register = ~self.buttons & 0xFF
+        data_val = self.shift_register & 1
+        if self.log.isEnabledFor(logging.DEBUG):
+            self.log.debug("latching nes latch: output: %d", data_val)
         self.dut.nes_data.value = data_val
 
-    # model the NES shift behavior
-    @cocotb.coroutine
-    async def nes_shift(self):
-        while True:
-            await RisingEdge(self.dut.nes_clk)
-            data_val = self.shift()
-            self.log.info(f"shifting nes clk: output: {data_val}")
-            self.dut.nes_data.value = data_val
-
+    @profiled
     def shift(self):
-        # Return current bit and advance shift register
-        if self.shift_index < 8:
-            self.shift_index += 1
-            value = self.shift_register[self.shift_index]
-            return value
-        else:
-            # After 8 reads, NES controllers return 1 (open bus)
-            return 1
+        # Advance the shift register and return the new output bit.
+        # Ones shift in behind the buttons, so after 8 reads NES controllers return 1 (open bus)
+        self.shift_register = (self.shift_register >> 1) | 0x80
+        return self.shift_register & 1
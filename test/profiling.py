@@ -0,0 +1,203 @@
+import functools
+import inspect
+import json
+import logging
+import os
+import time
+
+import cocotb
+from cocotb.utils import get_sim_time
+
+try:
+    from cocotb.log import SimLogFormatter
+except ImportError:
+    from cocotb.logging import SimLogFormatter
+
+# Opt-in with PROFILE=1. Without it the decorators return the functions unchanged.
+PROFILE = os.environ.get("PROFILE", "0") not in ("", "0")
+
+# One JSON record per test is appended here, relative to the simulator's directory
+PROFILE_FILE = os.environ.get("PROFILE_FILE", "profile.jsonl")
+
+# The profile of the running test, if any
+_current = None
+
+# Private scheduler methods the trigger count and Python time hook into. They only
+# exist in cocotb 1.x, elsewhere both are reported as n/a.
+SCHEDULER_HOOKS = ("_resume_coro_upon", "_schedule")
+
+def _scheduler():
+    scheduler = getattr(cocotb, "scheduler", None)
+    if not cocotb.__version__.startswith("1.") or scheduler is None:
+        return None
+    if not all(hasattr(scheduler, name) for name in SCHEDULER_HOOKS):
+        return None
+    return scheduler
+
+def _cocotb_handlers():
+    # The handlers cocotb's default_config put on the root logger
+    return [handler for handler in logging.getLogger().handlers if isinstance(handler.formatter, SimLogFormatter)]
+
+def _format(value, spec):
+    return "n/a" if value is None else format(value, spec)
+
+class _Timed:
+    # Awaits a coroutine, timing only the steps it spends running Python.
+    # Time suspended on a trigger (the simulator, other tasks) is not counted.
+
+    __slots__ = ("coro", "stats")
+
+    def __init__(self, coro, stats):
+        self.coro = coro
+        self.stats = stats
+
+    def __await__(self):
+        send, error = None, None
+        elapsed = 0.0
+        try:
+            while True:
+                start = time.perf_counter()
+                try:
+                    trigger = self.coro.throw(error) if error else self.coro.send(send)
+                except StopIteration as done:
+                    return done.value
+                finally:
+                    elapsed += time.perf_counter() - start
+                try:
+                    send, error = (yield trigger), None
+                except BaseException as e:
+                    send, error = None, e
+        finally:
+            self.stats[0] += 1
+            self.stats[1] += elapsed
+
+def _stats(name):
+    return _current.functions.setdefault(name, [0, 0.0]) if _current else [0, 0.0]
+
+def profiled(func):
+    # Accumulate calls and Python time of func into the running test's profile
+    if not PROFILE:
+        return func
+    name = func.__qualname__
+
+    if inspect.iscoroutinefunction(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            return await _Timed(func(*args, **kwargs), _stats(name))
+    else:
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                stats = _stats(name)
+                stats[0] += 1
+                stats[1] += time.perf_counter() - start
+    return wrapper
+
+class Profile:
+    # Whole test numbers: wall and simulated time, triggers awaited, and the
+    # time cocotb spends running Python (coroutines and logging) rather than the simulator
+
+    def __init__(self, name):
+        self.name = name
+        self.functions = {}
+        self.triggers = 0
+        self.python_s = 0.0
+        self.logging_s = 0.0
+        self.depth = 0
+
+    def start(self):
+        self._restore = []
+        scheduler = _scheduler()
+        if scheduler is None:
+            self.triggers = self.python_s = None
+        else:
+            self._hook_scheduler(scheduler)
+        for handler in _cocotb_handlers():
+            self._hook_handler(handler)
+        self.wall_start = time.perf_counter()
+        self.sim_start = get_sim_time("ns")
+
+    def _hook_scheduler(self, scheduler):
+        resume, schedule = scheduler._resume_coro_upon, scheduler._schedule
+
+        def counting_resume(coro, trigger):
+            self.triggers += 1
+            return resume(coro, trigger)
+
+        def timed_schedule(coroutine, trigger=None):
+            self.depth += 1
+            start = time.perf_counter()
+            try:
+                return schedule(coroutine, trigger)
+            finally:
+                self.depth -= 1
+                if not self.depth:
+                    self.python_s += time.perf_counter() - start
+
+        # Instance attributes shadow the methods, deleting them restores the originals
+        scheduler._resume_coro_upon = counting_resume
+        scheduler._schedule = timed_schedule
+        self._restore.append(lambda: (delattr(scheduler, "_resume_coro_upon"), delattr(scheduler, "_schedule")))
+
+    def _hook_handler(self, handler):
+        handle = handler.handle
+
+        def timed_handle(record):
+            start = time.perf_counter()
+            try:
+                return handle(record)
+            finally:
+                self.logging_s += time.perf_counter() - start
+
+        handler.handle = timed_handle
+        self._restore.append(lambda: delattr(handler, "handle"))
+
+    def stop(self):
+        self.wall_s = time.perf_counter() - self.wall_start
+        self.sim_ns = get_sim_time("ns") - self.sim_start
+        for restore in self._restore:
+            restore()
+
+    def record(self):
+        return {
+            "test": self.name,
+            "seed": cocotb.RANDOM_SEED,
+            "wall_s": self.wall_s,
+            "sim_ns": self.sim_ns,
+            "sim_ns_per_s": self.sim_ns / max(self.wall_s, 1e-9),
+            "triggers": self.triggers,
+            "python_s": self.python_s,
+            "logging_s": self.logging_s,
+            "functions": {name: {"calls": calls, "seconds": seconds} for name, (calls, seconds) in self.functions.items()},
+        }
+
+    def summary(self):
+        lines = [f"Profile of {self.name}: {self.wall_s:.2f} s wall, {self.sim_ns:.0f} ns simulated "
+                 f"({self.sim_ns / max(self.wall_s, 1e-9):.0f} ns/s), {_format(self.triggers, '')} triggers, "
+                 f"{_format(self.python_s, '.2f')} s in Python of which {self.logging_s:.2f} s logging"]
+        for name, (calls, seconds) in sorted(self.functions.items(), key=lambda item: -item[1][1]):
+            lines.append(f"  {name:<32} {calls:>8} calls {seconds:>8.3f} s")
+        return "\n".join(lines)
+
+def profile_test(func):
+    # Profile a whole cocotb test, goes beneath @cocotb.test()
+    if not PROFILE:
+        return func
+
+    @functools.wraps(func)
+    async def wrapper(dut, *args, **kwargs):
+        global _current
+        _current = profile = Profile(func.__name__)
+        profile.start()
+        try:
+            return await func(dut, *args, **kwargs)
+        finally:
+            profile.stop()
+            _current = None
+            dut._log.info(profile.summary())
+            with open(PROFILE_FILE, "a") as f:
+                f.write(json.dumps(profile.record()) + "\n")
+    return wrapper
@@ -0,0 +1,90 @@
+import zlib
+from array import array
+from itertools import combinations, repeat
+
+import cocotb
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# Button schedules for the controller models, generated up front from one seed.
+#
+# Every step of a schedule is a button state (which buttons are down) and how many
+# controller frames it is held for, going from one step to the next presses and
+# releases buttons. Draws come from splitmix64 over (seed, stream, step), which
+# NumPy computes for the whole schedule at once and plain Python one step at a time,
+# so the same seed gives the same schedule with or without NumPy installed, and no
+# matter what else in the test uses `random`.
+
+MASK64 = (1 << 64) - 1
+GOLDEN = 0x9E3779B97F4A7C15
+
+# Steps converted from arrays to Python ints at a time while streaming
+CHUNK = 4096
+
+def splitmix64(x):
+    x = (x + GOLDEN) & MASK64
+    x = ((x ^ (x >> 30)) * 0xBF58476D1CE4E5B9) & MASK64
+    x = ((x ^ (x >> 27)) * 0x94D049BB133111EB) & MASK64
+    return x ^ (x >> 31)
+
+def stream_key(seed, stream):
+    # Independent streams of one seed, e.g. one per test and controller
+    return splitmix64((seed ^ (zlib.crc32(stream.encode()) << 32)) & MASK64)
+
+def draws(key, start, count):
+    # Two draws per step, for the state and the hold
+    if np is not None:
+        with np.errstate(over="ignore"):
+            x = np.uint64(key) + np.arange(2 * start, 2 * (start + count), dtype=np.uint64) * np.uint64(GOLDEN)
+            x = x + np.uint64(GOLDEN)
+            x = (x ^ (x >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+            x = (x ^ (x >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+            x = x ^ (x >> np.uint64(31))
+        return x[0::2], x[1::2]
+    x = [splitmix64((key + i * GOLDEN) & MASK64) for i in range(2 * start, 2 * (start + count))]
+    return x[0::2], x[1::2]
+
+def button_states(controller, max_pressed):
+    # Every state of the controller's buttons with at most max_pressed of them down
+    masks = [controller.BUTTON_MASKS[btn] for btn in controller.BUTTONS]
+    return [sum(pressed) for count in range(max_pressed + 1) for pressed in combinations(masks, count)]
+
+class ButtonSchedule:
+
+    # steps button states for controller (NES_Controller or SNES_Controller), each held
+    # for hold[0] to hold[1] frames. seed defaults to cocotb's RANDOM_SEED.
+    __slots__ = ("seed", "stream", "table", "hold", "states", "holds")
+
+    def __init__(self, controller, steps, stream, max_pressed=2, hold=(1, 5), seed=None):
+        self.seed = cocotb.RANDOM_SEED if seed is None else seed
+        self.stream = stream
+        self.table = button_states(controller, max_pressed)
+        self.hold = hold
+        key = stream_key(self.seed, stream)
+        state_draws, hold_draws = draws(key, 0, steps)
+        span = hold[1] - hold[0] + 1
+        if np is not None:
+            table = np.array(self.table, dtype=np.uint16)
+            self.states = table[(state_draws % np.uint64(len(table))).astype(np.intp)]
+            self.holds = (hold_draws % np.uint64(span)).astype(np.uint16) + np.uint16(hold[0])
+        else:
+            self.states = array("H", (self.table[x % len(self.table)] for x in state_draws))
+            self.holds = array("H", (hold[0] + x % span for x in hold_draws))
+
+    def __len__(self):
+        return len(self.states)
+
+    def __iter__(self):
+        # (state, frames held) per step, converted a chunk at a time
+        for start in range(0, len(self.states), CHUNK):
+            states = self.states[start:start + CHUNK].tolist()
+            holds = self.holds[start:start + CHUNK].tolist()
+            yield from zip(states, holds)
+
+    def frames(self, compression=1):
+        # One state per controller frame, holds divided by compression (at least a frame)
+        for state, hold in self:
+            yield from repeat(state, max(1, hold // compression))
@@ -0,0 +1,264 @@
+import heapq
+from collections import deque
+import cocotb
+from cocotb import logging
+from cocotb.triggers import Edge, First, ReadOnly, RisingEdge, Timer
+from cocotb.utils import get_sim_time
+from nes import NES_Controller
+from snes import SNES_Controller
+from profiling import profiled
+
+class Delayed:
+
+    # A value as seen by the flops of the peripheral, delay cycles after the pin
+    # or register that drives it changed. Only the last few changes are kept,
+    # which covers any lookup the model makes as pins toggle at most once a cycle.
+    __slots__ = ("delay", "base", "changes")
+
+    HISTORY = 8
+
+    def __init__(self, value, delay):
+        self.delay = delay
+        self.base = value
+        self.changes = deque()
+
+    def set(self, cycle, value):
+        # Returns the first cycle at which the new value is seen
+        if len(self.changes) == self.HISTORY:
+            self.base = self.changes.popleft()[1]
+        seen = cycle + self.delay
+        self.changes.append((seen, value))
+        return seen
+
+    def at(self, cycle):
+        for seen, value in reversed(self.changes):
+            if seen <= cycle:
+                return value
+        return self.base
+
+class Scoreboard:
+
+    # Reference model of the controller pins -> NES_Reciever / Gamepad PMOD driver ->
+    # std_btn_reg, ext_btn_reg and status_reg pipeline of tqvp_nes_snes_controller.
+    #
+    # The monitor only watches the pins, plus one timed wakeup around the end of each
+    # frame so it is never overwritten unchecked. Each pin change is mapped to the first clock
+    # edge at which the peripheral sees it, so the model can follow the frame FSM
+    # cycle by cycle without stepping on every clock: only the cycles where a
+    # controller clock or is_snes changes are evaluated. Every frame the FSM latches
+    # is checked once against the registers, in constant time and memory.
+
+    # Controller pins on ui_in, see tb.v. The NES latch and clock come from uo_out.
+    NES_DATA_BIT = 1
+    SNES_DATA_BIT = 2
+    SNES_CLK_BIT = 3
+    SNES_LATCH_BIT = 4
+
+    # Clock edges between a pin change and the peripheral seeing it. uo_out comes
+    # straight from the peripheral's own registers, ui_in passes through the two
+    # stage synchronizer in tt_wrapper.v, then the PMOD driver syncs it twice more
+    # and takes one more edge to latch data_reg.
+    NES_DELAY = 1
+    SNES_DELAY = 3
+    DATA_REG_DELAY = 6
+
+    # Falling n_clk edges counted per frame, and the cycles from the last one to the
+    # registers updating (clk_count reaches 0, then enable_button_regs is set)
+    NES_CLOCKS = 7
+    SNES_CLOCKS = 11
+    UPDATE_CYCLES = 2
+
+    # The NES_Reciever shifts A first, its button registers reset to 0 (all pressed)
+    NES_STD_BITS = {i: 7 - i for i in range(len(NES_Controller.BUTTONS))}
+
+    def __init__(self, dut, period_ns=16):
+        self.dut = dut
+        self.log = logging.getLogger("cocotb.tb.scoreboard")
+        self.log.setLevel("INFO")  # Optional: DEBUG logs every checked frame
+        self.period = int(period_ns * 1000)
+        self.regs = dut.test_harness.user_peripheral
+        self.task = None
+        # Frames checked, and frames overwritten before they could be read (must stay 0)
+        self.frames = 0
+        self.unchecked = 0
+        # Expected register values of the last latched frame
+        self.std_btn = 0
+        self.ext_btn = 0
+
+    def reset(self):
+        uo_out = self.dut.uo_out.value.integer
+        ui_in = self.dut.ui_in.value.integer
+        self.uo_out = uo_out
+        self.ui_in = ui_in
+        self.nes_clk = Delayed((uo_out >> NES_Controller.CLK_BIT) & 1, self.NES_DELAY)
+        self.snes_clk = Delayed((ui_in >> self.SNES_CLK_BIT) & 1, self.SNES_DELAY)
+        # NES_Reciever button registers (as pressed bits of std_btn_reg) and the next bit read
+        self.nes_std = Delayed(0xFF, self.NES_DELAY)
+        self.nes_bit = 0
+        # PMOD driver shift register and data_reg, both reset to "not present"
+        self.snes_shift = SNES_Controller.DISCONNECTED
+        self.data_reg = Delayed(SNES_Controller.DISCONNECTED, self.DATA_REG_DELAY)
+        # Frame FSM: clk_count resets for NES as no PMOD is present yet
+        self.clk_count = self.NES_CLOCKS
+        self.dead_until = -1
+        self.evaluated = -1
+        self.candidates = []
+        # Next register update as (cycle, std_btn, ext_btn), None once checked
+        self.pending = None
+
+    # Start the monitor once the design is out of reset
+    async def start(self):
+        await RisingEdge(self.dut.clk)
+        self.start_ps = self.now_ps()
+        self.reset()
+        self.task = cocotb.start_soon(self.monitor())
+
+    # Check the last frame if it has reached the registers, stop the monitor and
+    # return the number of frames checked
+    async def finish(self):
+        await ReadOnly()
+        cycle = self.cycle()
+        self.advance(cycle)
+        self.check(cycle)
+        if self.task is not None:
+            self.task.kill()
+            self.task = None
+        self.log.info(f"Checked {self.frames} frames, {self.unchecked} unchecked")
+        assert self.unchecked == 0, f"{self.unchecked} frames reached the registers but were never checked"
+        return self.frames
+
+    def now_ps(self):
+        return int(round(get_sim_time("ps")))
+
+    def cycle(self):
+        return (self.now_ps() - self.start_ps) // self.period
+
+    def present(self, cycle):
+        return self.data_reg.at(cycle) != SNES_Controller.DISCONNECTED
+
+    def n_clk(self, cycle):
+        # The peripheral's latch/n_clk mux follows is_snes
+        return self.snes_clk.at(cycle) if self.present(cycle) else self.nes_clk.at(cycle)
+
+    def expected(self, cycle):
+        # (std_btn_reg, ext_btn_reg) loaded at this cycle
+        data_reg = self.data_reg.at(cycle)
+        if data_reg != SNES_Controller.DISCONNECTED:
+            return SNES_Controller.registers(data_reg)
+        return self.nes_std.at(cycle), 0
+
+    def wakeup(self):
+        # The pins alone may not change again before the next frame overwrites the
+        # registers, so wake up mid-cycle once the pending frame can be checked, and
+        # once the clock edge that may end the frame has been evaluated
+        cycles = []
+        if self.pending is not None:
+            cycles.append(self.pending[0] + 1)
+        if self.clk_count == 1 and self.candidates:
+            cycles.append(self.candidates[0] + self.UPDATE_CYCLES + 1)
+        if not cycles:
+            return None
+        cycle = max(min(cycles), self.cycle() + 1)
+        return Timer(self.start_ps + cycle * self.period + self.period // 2 - self.now_ps(), "ps")
+
+    async def monitor(self):
+        pins_changed = First(Edge(self.dut.uo_out), Edge(self.dut.ui_in))
+        while True:
+            wakeup = self.wakeup()
+            if wakeup is None:
+                await pins_changed
+            else:
+                await First(Edge(self.dut.uo_out), Edge(self.dut.ui_in), wakeup)
+            uo_out = self.dut.uo_out.value
+            ui_in = self.dut.ui_in.value
+            if not (uo_out.is_resolvable and ui_in.is_resolvable):
+                continue
+            cycle = self.cycle()
+            self.advance(cycle)
+            self.check(cycle)
+            self.pins(cycle, uo_out.integer, ui_in.integer)
+
+    def pins(self, cycle, uo_out, ui_in):
+        # Apply the pin changes of this cycle
+        uo_changed = uo_out ^ self.uo_out
+        ui_changed = ui_in ^ self.ui_in
+        self.uo_out = uo_out
+        self.ui_in = ui_in
+        rising_ui = ui_changed & ui_in
+
+        # NES_Reciever reads A when the latch falls and each other button before the
+        # clock falls, the data line only moves on rising edges so it is read here
+        nes_data = (ui_in >> self.NES_DATA_BIT) & 1
+        if uo_changed & (1 << NES_Controller.LATCH_BIT) and not uo_out & (1 << NES_Controller.LATCH_BIT):
+            self.nes_bit = 0
+            self.nes_read(cycle, nes_data)
+        if uo_changed & (1 << NES_Controller.CLK_BIT):
+            clk = (uo_out >> NES_Controller.CLK_BIT) & 1
+            heapq.heappush(self.candidates, self.nes_clk.set(cycle, clk))
+            if not clk:
+                self.nes_read(cycle, nes_data)
+
+        # The PMOD driver shifts on rising clocks and loads data_reg on the rising latch
+        if ui_changed & (1 << self.SNES_CLK_BIT):
+            heapq.heappush(self.candidates, self.snes_clk.set(cycle, (ui_in >> self.SNES_CLK_BIT) & 1))
+            if rising_ui & (1 << self.SNES_CLK_BIT):
+                self.snes_shift = ((self.snes_shift << 1) | ((ui_in >> self.SNES_DATA_BIT) & 1)) & 0xFFF
+        if rising_ui & (1 << self.SNES_LATCH_BIT):
+            heapq.heappush(self.candidates, self.data_reg.set(cycle, self.snes_shift))
+
+    def nes_read(self, cycle, data):
+        if self.nes_bit in self.NES_STD_BITS:
+            mask = 1 << self.NES_STD_BITS[self.nes_bit]
+            std = self.nes_std.at(cycle + self.NES_DELAY)
+            std = std & ~mask if data else std | mask
+            self.nes_std.set(cycle, std)
+        self.nes_bit += 1
+
+    def advance(self, cycle):
+        # Run the frame FSM over the cycles up to two before this one, everything that
+        # decides an edge or the values loaded at its update has been seen by then
+        last = cycle - self.UPDATE_CYCLES
+        candidates = self.candidates
+        while candidates and candidates[0] <= last:
+            k = heapq.heappop(candidates)
+            if k <= self.evaluated:
+                continue
+            self.evaluated = k
+            if k <= self.dead_until or not (self.n_clk(k - 1) and not self.n_clk(k)):
+                continue
+            self.clk_count -= 1
+            if self.clk_count:
+                continue
+            # clk_count is 0 on the next edge, then TRIGGER ignores edges for a cycle
+            # and reloads the count for the active controller
+            update = k + self.UPDATE_CYCLES
+            self.dead_until = update
+            self.clk_count = self.SNES_CLOCKS if self.present(update) else self.NES_CLOCKS
+            if self.pending is not None:
+                if self.pending[0] < cycle < update:
+                    self.check(cycle)
+                else:
+                    self.unchecked += 1
+            self.pending = (update, *self.expected(update))
+
+    @profiled
+    def check(self, cycle):
+        # Registers hold the pending frame from the cycle after its update
+        if self.pending is None or cycle <= self.pending[0]:
+            return
+        update, std_btn, ext_btn = self.pending
+        self.pending = None
+        self.std_btn, self.ext_btn = std_btn, ext_btn
+        regs = self.regs
+        actual = (regs.std_btn_reg.value.integer, regs.ext_btn_reg.value.integer)
+        self.frames += 1
+        if self.log.isEnabledFor(logging.DEBUG):
+            self.log.debug(f"frame {self.frames} at cycle {update}: std_btn={std_btn:08b}, ext_btn={ext_btn:04b}")
+        assert actual == (std_btn, ext_btn), \
+            f"Frame {self.frames} latched at cycle {update}: std_btn={actual[0]:08b}, ext_btn={actual[1]:08b}, " \
+            f"expected std_btn={std_btn:08b}, ext_btn={ext_btn:08b}"
+        # status_reg bit 0 follows is_snes every cycle, skip the check on the cycle it changes
+        present = self.present(cycle)
+        if present == self.present(cycle - 1):
+            status = regs.status_reg.value.integer & 1
+            assert status == int(present), f"status_reg[0]={status} at cycle {cycle}, expected {int(present)}"
@@ -0,0 +1,130 @@
+import cocotb
+from cocotb import logging
+from cocotb.triggers import ClockCycles
+from profiling import profiled
+
+class SNES_Controller:
+
+    # SNES controller buttons in the order they are shifted out by the Gamepad PMOD
+    BUTTONS = ["B", "Y", "Select", "Start", "Up", "Down", "Left", "Right", "A", "X", "L", "R"]
+
+    # Mask of each button in a 12-bit button state, B is shifted out first (MSB)
+    BUTTON_MASKS = {btn: 1 << (11 - i) for i, btn in enumerate(BUTTONS)}
+
+    # The PMOD reports all ones when no controller is connected
+    DISCONNECTED = 0xFFF
+
+    __slots__ = ("dut", "id", "log", "_buttons", "half_cycles", "frame_cycles", "frames", "_waits", "latency")
+
+    # half_cycles is the PMOD clock half period and frame_cycles the time from
+    # the start of one frame to the next, both in clk cycles
+    def __init__(self, dut, half_cycles=4, frame_cycles=256):
+        self.dut = dut
+        global_snes_controller_id = getattr(SNES_Controller, "global_id", 0)
+        self.id = global_snes_controller_id
+        SNES_Controller.global_id = global_snes_controller_id + 1
+        self.log = logging.getLogger(f"cocotb.tb.snes_controller_{self.id}")
+        self.log.setLevel("INFO")  # Optional: set log level per class, DEBUG traces every frame
+        self.half_cycles = half_cycles
+        self.frame_cycles = frame_cycles
+        self._waits = {}
+        self.latency = None
+        self.reset()
+
+    def reset(self):
+        # Pressed buttons, one bit per button
+        self._buttons = 0
+        # Frames driven so far
+        self.frames = 0
+
+    @property
+    def buttons(self):
+        return self._buttons
+
+    @buttons.setter
+    def buttons(self, state):
+        # The latency monitor timestamps the presses, see latency.py
+        if self.latency is not None:
+            self.latency.buttons(self, state)
+        self._buttons = state
+
+    @property
+    def button_states(self):
+        return {btn: bool(self.buttons & mask) for btn, mask in self.BUTTON_MASKS.items()}
+
+    def press(self, button):
+        if button in self.BUTTON_MASKS:
+            self.log.info("pressing button: %s", button)
+            self.buttons |= self.BUTTON_MASKS[button]
+        return button
+
+    def release(self, button):
+        if button in self.BUTTON_MASKS:
+            self.log.info("releasing button: %s", button)
+            self.buttons &= ~self.BUTTON_MASKS[button]
+
+    # The (std_btn_reg, ext_btn_reg) values the peripheral reports for a button state.
+    # The PMOD decoder drops frames with more than two buttons pressed.
+    @classmethod
+    def registers(cls, state):
+        if state == cls.DISCONNECTED or bin(state).count("1") > 2:
+            return 0, 0
+        pressed = lambda btn: int(bool(state & cls.BUTTON_MASKS[btn]))
+        std_btn = 0
+        for btn in ["A", "B", "Select", "Start", "Up", "Down", "Left", "Right"]:
+            std_btn = (std_btn << 1) | pressed(btn)
+        ext_btn = 0
+        for btn in ["X", "Y", "L", "R"]:
+            ext_btn = (ext_btn << 1) | pressed(btn)
+        return std_btn, ext_btn
+
+    # modelling methods
+    @cocotb.coroutine
+    async def model_snes(self):
+        cocotb.start_soon(self.run())
+
+    # Drive one frame per button state taken from states, or the pressed buttons
+    # forever when states is None. states can be any iterator, so long streams
+    # are never built up front.
+    async def run(self, states=None):
+        if states is None:
+            while True:
+                await self.frame(self.buttons)
+        for state in states:
+            await self.frame(state)
+
+    # Stop the PMOD reporting a controller, so the peripheral falls back to NES
+    async def disconnect(self, frames=1):
+        for _ in range(frames):
+            await self.frame(self.DISCONNECTED)
+
+    def wait(self, cycles):
+        trigger = self._waits.get(cycles)
+        if trigger is None:
+            trigger = self._waits[cycles] = ClockCycles(self.dut.clk, cycles)
+        return trigger
+
+    # Shift out the 12 button bits MSB first, sampled on the rising PMOD clock,
+    # then pulse the latch to transfer them into the PMOD data register
+    @profiled
+    async def frame(self, state):
+        dut = self.dut
+        half = self.wait(self.half_cycles)
+        if self.log.isEnabledFor(logging.DEBUG):
+            self.log.debug("frame %d: state %03x", self.frames, state)
+        if self.latency is not None:
+            self.latency.buttons(self, state)
+        dut.snes_latch.value = 0
+        for bit in range(11, -1, -1):
+            dut.snes_clk.value = 0
+            dut.snes_data.value = (state >> bit) & 1
+            await half
+            dut.snes_clk.value = 1
+            await half
+        dut.snes_latch.value = 1
+        await half
+        dut.snes_latch.value = 0
+        idle = self.frame_cycles - 26 * self.half_cycles
+        if idle > 0:
+            await self.wait(idle)
+        self.frames += 1
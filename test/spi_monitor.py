@@ -0,0 +1,103 @@
+import cocotb
+from cocotb import logging
+from cocotb.triggers import Edge, First
+from cocotb.utils import get_sim_time
+from spi_trace import TraceWriter
+
+class SpiMonitor:
+
+    # Passive monitor of the register SPI bus on uio_in/uio_out (mode 0, see tqv_reg.py).
+    # Every 16 bit command/data transaction, including each one of a burst, becomes a
+    # (time, command, data) record in a binary trace, see spi_trace.py.
+
+    # SPI pins, CS, SCK and MOSI on uio_in, MISO on uio_out
+    CS_BIT = 4
+    SCK_BIT = 5
+    MOSI_BIT = 6
+    MISO_BIT = 3
+
+    # One writer per trace file, shared by the monitors of every test in the simulation
+    _writers = {}
+
+    def __init__(self, dut, path):
+        self.dut = dut
+        self.log = logging.getLogger("cocotb.tb.spi_monitor")
+        self.log.setLevel("INFO")  # Optional: DEBUG logs every transaction
+        writer = self._writers.get(path)
+        if writer is None:
+            writer = self._writers[path] = TraceWriter(path)
+        self.writer = writer
+        self.transactions = 0
+        self.task = None
+
+    def start(self):
+        self.task = cocotb.start_soon(self.monitor())
+
+    def stop(self):
+        if self.task is not None:
+            self.task.kill()
+            self.task = None
+        self.writer.flush()
+
+    async def monitor(self):
+        port_in = self.dut.uio_in
+        port_out = self.dut.uio_out
+        self.reset(port_in.value.integer if port_in.value.is_resolvable else 1 << self.CS_BIT)
+        pins_changed = First(Edge(port_in), Edge(port_out))
+        while True:
+            await pins_changed
+            in_value = port_in.value
+            out_value = port_out.value
+            self.pins(get_sim_time("ps"), in_value.integer if in_value.is_resolvable else None,
+                      out_value.integer if out_value.is_resolvable else None)
+
+    def reset(self, port_in):
+        self.prev = port_in
+        self.miso = 0
+        # MISO before a change in the current time step, the driver samples it on
+        # the clock edge, before the peripheral's registers update
+        self.miso_before = 0
+        self.miso_changed_ps = -1
+        # Bits clocked in so far, MOSI and MISO shift registers, start of the transaction
+        self.bits = 0
+        self.mosi = 0
+        self.data_in = 0
+        self.start_ps = 0
+
+    def pins(self, now_ps, port_in, port_out):
+        if port_out is not None:
+            miso = (port_out >> self.MISO_BIT) & 1
+            if miso != self.miso:
+                self.miso_before, self.miso_changed_ps, self.miso = self.miso, now_ps, miso
+        if port_in is None:
+            return
+        changed = port_in ^ self.prev
+        self.prev = port_in
+
+        if port_in & (1 << self.CS_BIT):
+            # End of frame, drop any partial transaction
+            if changed & (1 << self.CS_BIT):
+                self.bits = 0
+                self.writer.flush()
+            return
+        if not changed & (1 << self.SCK_BIT):
+            return
+
+        if port_in & (1 << self.SCK_BIT):
+            # MOSI is sampled on the rising edge
+            if self.bits == 0:
+                self.start_ps = now_ps
+            self.mosi = ((self.mosi << 1) | ((port_in >> self.MOSI_BIT) & 1)) & 0xFFFF
+            self.bits += 1
+        elif self.bits > 8:
+            # MISO is sampled by the driver before the clock falls
+            bit = self.miso_before if self.miso_changed_ps == now_ps else self.miso
+            self.data_in = ((self.data_in << 1) | bit) & 0xFF
+            if self.bits == 16:
+                command = self.mosi >> 8
+                data = self.mosi & 0xFF if command & 0x80 else self.data_in
+                self.writer.write(int(round(self.start_ps)), command, data)
+                self.transactions += 1
+                if self.log.isEnabledFor(logging.DEBUG):
+                    self.log.debug(f"{'write' if command & 0x80 else 'read'} {command & 0xF}: {data:08b}")
+                self.bits = 0
@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+# Binary trace of the SPI register traffic, written by spi_monitor.py and read here.
+#
+# The file is an 8 byte magic and a version byte, then one 10 byte record per
+# transaction: the simulation time in ps (uint64), the command byte as sent on the
+# bus (bit 7 set for writes, bits 3:0 the address) and the data byte written or read.
+#
+#   python spi_trace.py spi.trace [-address 2] [-writes | -reads] [-summary]
+
+import argparse
+import os
+import struct
+import sys
+from collections import namedtuple
+
+MAGIC = b"SPITRACE"
+VERSION = 1
+HEADER = struct.Struct("<8sB")
+RECORD = struct.Struct("<QBB")
+
+WRITE = 0x80
+
+SpiRecord = namedtuple("SpiRecord", ["time_ps", "write", "address", "data"])
+
+class TraceWriter:
+
+    # Appends records to a trace, the header is only written to a new file so the
+    # tests of one simulation (or several runs) share a trace
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, "ab")
+        if self.file.tell() == 0:
+            self.file.write(HEADER.pack(MAGIC, VERSION))
+
+    def write(self, time_ps, command, data):
+        self.file.write(RECORD.pack(time_ps, command, data))
+
+    def flush(self):
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+def read_trace(path):
+    # Returns every record of a trace as a list of SpiRecord
+    with open(path, "rb") as f:
+        data = f.read()
+    if len(data) < HEADER.size:
+        raise ValueError(f"{path} is not an SPI trace")
+    magic, version = HEADER.unpack_from(data)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError(f"{path} is not a version {VERSION} SPI trace")
+    # A simulation killed mid-write can leave a partial record at the end
+    end = len(data) - (len(data) - HEADER.size) % RECORD.size
+    return [SpiRecord(time_ps, bool(command & WRITE), command & 0xF, value)
+            for time_ps, command, value in RECORD.iter_unpack(data[HEADER.size:end])]
+
+def summarise(records):
+    # Reads and writes per address, and the last value seen on each
+    summary = {}
+    for record in records:
+        entry = summary.setdefault(record.address, {"reads": 0, "writes": 0, "last": None})
+        entry["writes" if record.write else "reads"] += 1
+        entry["last"] = record.data
+    return summary
+
+def main():
+    parser = argparse.ArgumentParser(description="Print an SPI register trace.")
+    parser.add_argument("trace", help="Trace written with SPI_TRACE=<file>")
+    parser.add_argument("-address", type=int, default=None, help="Only this register address")
+    direction = parser.add_mutually_exclusive_group()
+    direction.add_argument("-writes", action="store_true", help="Only writes")
+    direction.add_argument("-reads", action="store_true", help="Only reads")
+    parser.add_argument("-summary", action="store_true", help="Count reads and writes per address instead")
+    args = parser.parse_args()
+
+    records = read_trace(args.trace)
+    if args.address is not None:
+        records = [r for r in records if r.address == args.address]
+    if args.writes or args.reads:
+        records = [r for r in records if r.write == args.writes]
+
+    if args.summary:
+        print(f"{len(records)} transactions, {os.path.getsize(args.trace)} bytes")
+        print(f"{'address':>7} {'reads':>8} {'writes':>8}  last")
+        for address, entry in sorted(summarise(records).items()):
+            print(f"{address:>7} {entry['reads']:>8} {entry['writes']:>8}  {entry['last']:08b}")
+        return
+
+    try:
+        for record in records:
+            print(f"{record.time_ps / 1000:>14.3f} ns  {'W' if record.write else 'R'} {record.address:>2}  {record.data:08b}")
+    except BrokenPipeError:
+        sys.stderr.close()
+
+if __name__ == "__main__":
+    main()
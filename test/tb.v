@@ -12,6 +12,9 @@
 module tb ();
 
   string vcdname; 
+  string dump_scope;
+  integer dump_start;
+  integer dump_stop;
 
   // Wire up the inputs and outputs:
   reg clk;
@@ -31,6 +34,9 @@ module tb ();
   reg nes_latch;
   reg nes_clk;
   reg nes_data;
+  reg snes_data;
+  reg snes_clk;
+  reg snes_latch;
 
   always @(*) begin
     nes_latch = uo_out[6];
@@ -38,6 +44,13 @@ module tb ();
     ui_in[1]  = nes_data;
   end
 
+  // SNES Gamepad PMOD pins, driven by the SNES controller model
+  always @(*) begin
+    ui_in[2]  = snes_data;
+    ui_in[3]  = snes_clk;
+    ui_in[4]  = snes_latch;
+  end
+
   tt_um_tqv_peripheral_harness test_harness (
 
       // Include power ports for the Gate Level test:
@@ -60,14 +73,41 @@ module tb ();
     nes_latch = 0;
     nes_clk = 0;
     nes_data = 0;
+    snes_data = 1;
+    snes_clk = 1;
+    snes_latch = 1;
+`ifndef VERILATOR
    // Dump the signals to a VCD file. You can view it with gtkwave or surfer.
-    if ($value$plusargs("VCD_PATH=%s", vcdname)) begin
-      $dumpfile(vcdname);
-    end else begin
-      $dumpfile("tb.vcd");
+   // +DUMP_SCOPE=tb|user_peripheral|none selects what is dumped (default tb),
+   // +DUMP_START=<ns> / +DUMP_STOP=<ns> limit the dump to a time window.
+   // Run vvp with -fst or -lxt2 for a compact format instead of VCD.
+   // Verilator traces from its own main loop instead, see the Makefile.
+    if (!$value$plusargs("DUMP_SCOPE=%s", dump_scope)) begin
+      dump_scope = "tb";
+    end
+    if (dump_scope != "none") begin
+      if ($value$plusargs("VCD_PATH=%s", vcdname)) begin
+        $dumpfile(vcdname);
+      end else begin
+        $dumpfile("tb.vcd");
+      end
+`ifndef GL_TEST
+      if (dump_scope == "user_peripheral") begin
+        $dumpvars(0, tb.test_harness.user_peripheral);
+      end else
+`endif
+      $dumpvars(0, tb);
+      if ($value$plusargs("DUMP_START=%d", dump_start)) begin
+        $dumpoff;
+        #(dump_start) $dumpon;
+      end
+      if ($value$plusargs("DUMP_STOP=%d", dump_stop)) begin
+        if (dump_stop > $time) #(dump_stop - $time);
+        $dumpoff;
+      end
     end
-    $dumpvars(0, tb);
     #1;
+`endif
   end
 
 endmodule
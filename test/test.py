@@ -1,96 +1,83 @@
 # SPDX-FileCopyrightText: © 2025 Tiny Tapeout
 # SPDX-License-Identifier: Apache-2.0
 
+import os
+from itertools import repeat
 from random import randint
 import cocotb
 from nes import NES_Controller
+from snes import SNES_Controller
 import asyncio
 
 from cocotb.clock import Clock
-from cocotb.triggers import ClockCycles, Timer, RisingEdge, FallingEdge
-from tqv import TinyQV
+from cocotb.triggers import ClockCycles, Timer, RisingEdge, FallingEdge, Edge, First, with_timeout
+from cocotb.utils import get_sim_time
+from tqv import TinyQV, NES_CTRL, NES_CLK_DIV, NES_INTERVAL, NES_MANUAL, NES_POLL, STATUS_REG, STATUS_SNES, STATUS_CHANGED, STATUS_OVERFLOW, EVENT_COUNT_SHIFT, EVENT_DEPTH
+from profiling import profiled, profile_test
+from scoreboard import Scoreboard
+from schedule import ButtonSchedule
+from latency import LatencyMonitor
 
 # When submitting your design, change this to 16 + the peripheral number
 PERIPHERAL_NUM = 16 
 
-expected_buttons_pressed_list = []
+# Number of frames streamed through the SNES model, override with SNES_FRAMES=<n>
+SNES_FRAMES = int(os.environ.get("SNES_FRAMES", 200))
 
-async def nes_sequence(dut, nes, tqv, num_presses=10):
+# Button holds are measured in NES controller frames, ~13065 cycles or ~204 us each
+# at the reset polling rate (see nes_frame_cycles), so 1-5 frames holds a press for
+# ~0.2-1 ms. That is longer than the old 50-500 us waits, but the registers only
+# update once per frame, so a shorter press could be missed entirely.
+# NES_TIME_COMPRESSION=<n> divides the frames held, down to a single frame, to
+# trade press length for simulation time.
+HOLD_FRAMES = (1, 5)
+NES_TIME_COMPRESSION = int(os.environ.get("NES_TIME_COMPRESSION", 1))
+
+# Button states streamed through the NES model by test_nes_soak, which only runs
+# with NES_SOAK=<states>. The scoreboard checks every frame.
+NES_SOAK = int(os.environ.get("NES_SOAK", 0))
+
+# (NES_CLK_DIV, NES_INTERVAL) settings swept by test_nes_poll_rate, the first is the reset value
+NES_POLL_SETTINGS = [(96, 0), (24, 0), (1, 0), (8, 2), (24, 4)]
+NES_POLL_FRAMES = 4
 
-    buttons = ["A", "B", "Select", "Start", "Up", "Down", "Left", "Right"]
+def nes_frame_cycles(clk_div, interval):
+    # Latch to latch: latch, A and 7 clocked bits take 17 half periods of 8 * clk_div
+    # cycles plus a cycle per state, then NES_INTERVAL * 4096 cycles in idle
+    return 17 * 8 * max(clk_div, 1) + 9 + (interval * 4096 + 1 if interval else 0)
 
-    print(f"pressing {num_presses} buttons..")
+async def wait_frames(dut, frames):
+    # Advance to the start of a later controller frame
+    for _ in range(frames):
+        await RisingEdge(dut.nes_latch)
+
+async def nes_sequence(dut, nes, tqv, num_presses=10):
+
+    # Up to two buttons down at a time, pressed and released by a schedule from RANDOM_SEED
+    schedule = ButtonSchedule(NES_Controller, num_presses, "nes_sequence", hold=HOLD_FRAMES)
+    print(f"pressing {num_presses} button states..")
     
     # Hold for start time
     start_delay = randint(0,1)
     await Timer(start_delay, units="ns")
 
-    pressed = set()
-    pressed_buttons = []
-
-    for _ in range(num_presses):
-        
-        # Choose 1 or 2 unique buttons to press
-        num_buttons = randint(0, 2)
-        
-        if len(expected_buttons_pressed_list) < 2:
-            # Add a one or two or zero buttons that are not already pressed
-            if len(expected_buttons_pressed_list) < 1:
-                for _ in range(num_buttons):
-                    available_buttons = [b for b in buttons if b not in pressed]
-                    if available_buttons:
-                            pressed.add(buttons.index(available_buttons[randint(0, len(available_buttons)-1)]))
-                    pressed_buttons = [buttons[i] for i in pressed]
-            # Add a one or zero buttons that are not already pressed
-            else:
-                if randint(1,2) == 2:
-                    available_buttons = [b for b in buttons if b not in pressed]
-                    if available_buttons:
-                        pressed.add(buttons.index(available_buttons[randint(0, len(available_buttons)-1)]))
-                        pressed_buttons = [buttons[i] for i in pressed]
-            
-        for button in pressed_buttons:
-            nes.press(button)
+    for state, hold in schedule:
 
+        # Change the buttons while the latch is low, the next frame latches them
+        if dut.nes_latch.value:
+            await FallingEdge(dut.nes_latch)
+        nes.buttons = state
         await RisingEdge(dut.nes_latch)
-        # print(f"adding button {pressed_buttons} to list.")
-        
-        for button in pressed_buttons:
-            expected_buttons_pressed_list.append(button)
-
-        # Hold for random time
-        hold_time = randint(50, 500)
-        await Timer(hold_time, units="us")
-
-        # Randomly release 1 or both buttons
-        num_release = randint(1, max(len(pressed_buttons),1))
-        
-        for button in pressed_buttons[:num_release]:
-            nes.release(button)
-            expected_buttons_pressed_list.remove(button)
-        
-async def check_data(dut, tqv):
-    button_map = {
-        "A":     0b10000000,
-        "B":     0b01000000,
-        "Select":0b00100000,
-        "Start": 0b00010000,
-        "Up":    0b00001000,
-        "Down":  0b00000100,
-        "Left":  0b00000010,
-        "Right": 0b00000001
-    }
-
-    # Wait for the complete transmission cycle
-    
-    # If no button was queued, skip this cycle
-    if len(expected_buttons_pressed_list) == 0:
-        return
 
-    expected_data_out = 0
-    
-    for b in expected_buttons_pressed_list:
-        expected_data_out |= button_map[b]
+        # Hold for a number of frames, checking over SPI once the first complete
+        # frame with the buttons pressed has reached the registers
+        await wait_frames(dut, 1)
+        await check_data(dut, nes, tqv)
+        await wait_frames(dut, max(1, hold // NES_TIME_COMPRESSION) - 1)
+
+@profiled
+async def check_data(dut, nes, tqv):
+    expected_data_out = NES_Controller.registers(nes.buttons)
 
     # Small random wait to simulate async timing
     await Timer(randint(10, 50), units="ns")
@@ -98,9 +85,10 @@ async def check_data(dut, tqv):
     val = await tqv.read_reg(0)
     dut._log.info(f"Async check: std_buttons={val:08b}, expected={expected_data_out:08b}")
 
-    assert val == expected_data_out , f"Mismatch for {expected_buttons_pressed_list}"
+    assert val == expected_data_out , f"Mismatch for {nes.button_states}"
 
 @cocotb.test()
+@profile_test
 async def test_nes(dut):
     dut._log.info("Start")
     tqv = TinyQV(dut, PERIPHERAL_NUM)
@@ -112,8 +100,299 @@ async def test_nes(dut):
     dut._log.info("Test project behavior")
     cocotb.start_soon(nes.model_nes())
     await tqv.reset()
+    scoreboard = Scoreboard(dut)
+    await scoreboard.start()
+    latency = LatencyMonitor(dut, "test_nes", nes)
+    await latency.start()
     
     await nes_sequence(dut, nes, tqv, num_presses=1)
 
     await ClockCycles(dut.clk, 10)
+    latency.finish()
+    assert await scoreboard.finish() > 0, "No NES frames reached the registers"
+
+@cocotb.test(skip=not NES_SOAK)
+@profile_test
+async def test_nes_soak(dut):
+    dut._log.info("Start")
+    tqv = TinyQV(dut, PERIPHERAL_NUM)
+    nes = NES_Controller(dut)
+    clock = Clock(dut.clk, 16, units="ns")
+    cocotb.start_soon(clock.start())
+    cocotb.start_soon(nes.model_nes())
+    await tqv.reset()
+    scoreboard = Scoreboard(dut)
+    await scoreboard.start()
+    latency = LatencyMonitor(dut, "test_nes_soak", nes)
+    await latency.start()
+
+    # Stream the whole schedule, the scoreboard checks every frame
+    schedule = ButtonSchedule(NES_Controller, NES_SOAK, "test_nes_soak", hold=HOLD_FRAMES)
+    sim_start = get_sim_time("ns")
+    await nes.run(schedule.frames(NES_TIME_COMPRESSION))
+    await wait_frames(dut, 1)
+    sim_ns = get_sim_time("ns") - sim_start
+    latency.finish()
+    frames = await scoreboard.finish()
+    dut._log.info(f"Soaked {len(schedule)} button states in {frames} frames, {1e9 * frames / sim_ns:.0f} frames/s simulated")
+    assert frames > 0, "No NES frames reached the registers"
+
+
+@profiled
+async def wait_for_reg(dut, name, expected, timeout_us=1000, mask=0xFF):
+    # Wait until the masked bits of a peripheral register hold the expected value,
+    # returns the time taken in ns
+    reg = getattr(dut.test_harness.user_peripheral, name)
+    start = get_sim_time("ns")
+    while reg.value.integer & mask != expected:
+        await with_timeout(Edge(reg), timeout_us, "us")
+    return get_sim_time("ns") - start
+
+@cocotb.test()
+@profile_test
+async def test_snes(dut):
+    dut._log.info("Start")
+    tqv = TinyQV(dut, PERIPHERAL_NUM)
+    snes = SNES_Controller(dut)
+    clock = Clock(dut.clk, 16, units="ns")
+    cocotb.start_soon(clock.start())
+    await tqv.reset()
+    scoreboard = Scoreboard(dut)
+    await scoreboard.start()
+    latency = LatencyMonitor(dut, "test_snes", snes)
+    await latency.start()
+
+    # Hold each state for a few frames, the button registers update once per frame
+    hold_frames = 4
+    for state, _ in ButtonSchedule(SNES_Controller, 25, "test_snes"):
+        await snes.run(repeat(state, hold_frames))
+        std_btn, ext_btn, status = await tqv.read_regs([0, 1, 2])
+        dut._log.info(f"SNES state {state:012b}: std_buttons={std_btn:08b}, ext_buttons={ext_btn:04b}")
+        assert status & STATUS_SNES, "SNES controller not detected"
+        assert (std_btn, ext_btn) == SNES_Controller.registers(state), f"Mismatch for SNES state {state:012b}"
+
+    # Stream frames straight from the generator, checking only the final state
+    final_state = SNES_Controller.BUTTON_MASKS["Y"] | SNES_Controller.BUTTON_MASKS["L"]
+    sim_start = get_sim_time("ns")
+    await snes.run(ButtonSchedule(SNES_Controller, SNES_FRAMES, "test_snes_stream", hold=(1, 1)).frames())
+    await snes.run(repeat(final_state, hold_frames))
+    sim_ns = get_sim_time("ns") - sim_start
+    dut._log.info(f"Streamed {SNES_FRAMES + hold_frames} SNES frames, {1e9 * (SNES_FRAMES + hold_frames) / sim_ns:.0f} frames/s simulated")
+    assert tuple(await tqv.read_regs([0, 1])) == SNES_Controller.registers(final_state)
+    latency.finish()
+    assert await scoreboard.finish() > 0, "No SNES frames reached the registers"
+
+@cocotb.test()
+@profile_test
+async def test_snes_switchover(dut):
+    dut._log.info("Start")
+    tqv = TinyQV(dut, PERIPHERAL_NUM)
+    nes = NES_Controller(dut)
+    snes = SNES_Controller(dut)
+    clock = Clock(dut.clk, 16, units="ns")
+    cocotb.start_soon(clock.start())
+    cocotb.start_soon(nes.model_nes())
+    await tqv.reset()
+    scoreboard = Scoreboard(dut)
+    await scoreboard.start()
+    latency = LatencyMonitor(dut, "test_snes_switchover", nes, snes)
+    await latency.start()
+
+    nes.press("A")
+    nes_std_btn = 0b10000000
+    await wait_for_reg(dut, "std_btn_reg", nes_std_btn)
+    assert not await tqv.read_reg(2) & STATUS_SNES, "NES controller should be active"
+
+    # NES -> SNES: start driving the PMOD
+    snes.press("X")
+    snes.press("Down")
+    snes_std_btn, snes_ext_btn = SNES_Controller.registers(snes.buttons)
+    snes_task = cocotb.start_soon(snes.run())
+    detect_ns = await wait_for_reg(dut, "status_reg", STATUS_SNES, mask=STATUS_SNES)
+    switch_ns = detect_ns + await wait_for_reg(dut, "std_btn_reg", snes_std_btn)
+    await wait_for_reg(dut, "ext_btn_reg", snes_ext_btn)
+    dut._log.info(f"NES -> SNES: detected after {detect_ns:.0f} ns ({detect_ns / 16:.0f} cycles), "
+                  f"buttons after {switch_ns:.0f} ns ({switch_ns / 16:.0f} cycles)")
+
+    # SNES -> NES: the PMOD reports no controller
+    snes_task.kill()
+    cocotb.start_soon(snes.disconnect())
+    detect_ns = await wait_for_reg(dut, "status_reg", 0, mask=STATUS_SNES)
+    switch_ns = detect_ns + await wait_for_reg(dut, "std_btn_reg", nes_std_btn)
+    dut._log.info(f"SNES -> NES: detected after {detect_ns:.0f} ns ({detect_ns / 16:.0f} cycles), "
+                  f"buttons after {switch_ns:.0f} ns ({switch_ns / 16:.0f} cycles)")
+    std_btn, ext_btn, status = await tqv.read_regs([0, 1, 2])
+    assert (std_btn, ext_btn, status & STATUS_SNES) == (nes_std_btn, 0, 0)
+    latency.finish()
+    await scoreboard.finish()
+
+@cocotb.test()
+@profile_test
+async def test_nes_poll_rate(dut):
+    dut._log.info("Start")
+    tqv = TinyQV(dut, PERIPHERAL_NUM)
+    nes = NES_Controller(dut)
+    clock = Clock(dut.clk, 16, units="ns")
+    cocotb.start_soon(clock.start())
+    cocotb.start_soon(nes.model_nes())
+    await tqv.reset()
+    scoreboard = Scoreboard(dut)
+    await scoreboard.start()
+    latency = LatencyMonitor(dut, "test_nes_poll_rate", nes)
+    await latency.start()
+
+    assert await tqv.read_regs([NES_CTRL, NES_CLK_DIV, NES_INTERVAL]) == [0, *NES_POLL_SETTINGS[0]]
+
+    # Sweep the automatic polling rate. Each setting takes over from the next latch,
+    # then the frame period is measured and a press is timed from a latch, close to
+    # the longest it can take to reach the registers.
+    results = []
+    for clk_div, interval in NES_POLL_SETTINGS:
+        await tqv.write_regs({NES_CLK_DIV: clk_div, NES_INTERVAL: interval})
+        assert await tqv.read_regs([NES_CLK_DIV, NES_INTERVAL]) == [clk_div, interval]
+        await RisingEdge(dut.nes_latch)
+        start = get_sim_time("ns")
+        await wait_frames(dut, NES_POLL_FRAMES)
+        frame_cycles = round((get_sim_time("ns") - start) / 16 / NES_POLL_FRAMES)
+        assert frame_cycles == nes_frame_cycles(clk_div, interval), \
+            f"NES frame of {frame_cycles} cycles for divider {clk_div}, interval {interval}"
+
+        nes.buttons ^= NES_Controller.BUTTON_MASKS["A"]
+        press_ns = await wait_for_reg(dut, "std_btn_reg", NES_Controller.registers(nes.buttons))
+        results.append((clk_div, interval, frame_cycles, press_ns))
+
+    # Manual polling: the frame in progress completes, then no frame starts until polled
+    await tqv.write_reg(NES_CTRL, NES_MANUAL)
+    await ClockCycles(dut.clk, nes_frame_cycles(clk_div, interval))
+    idle = ClockCycles(dut.clk, 2 * nes_frame_cycles(*NES_POLL_SETTINGS[0]))
+    assert await First(RisingEdge(dut.nes_latch), idle) is idle, "NES frame started without a poll"
+
+    # A poll reads back as pending until its frame latches, then exactly one frame runs
+    nes.buttons ^= NES_Controller.BUTTON_MASKS["Start"]
+    await tqv.write_reg(NES_CTRL, NES_MANUAL | NES_POLL)
+    poll_ns = await wait_for_reg(dut, "std_btn_reg", NES_Controller.registers(nes.buttons))
+    assert await tqv.read_reg(NES_CTRL) == NES_MANUAL, "NES poll request not cleared"
+    assert await First(RisingEdge(dut.nes_latch), idle) is idle, "More than one NES frame per poll"
+
+    dut._log.info(f"{'divider':>7} {'interval':>8} {'frame':>12} {'rate':>10} {'latency':>10}")
+    for clk_div, interval, frame_cycles, press_ns in results:
+        dut._log.info(f"{clk_div:>7} {interval:>8} {frame_cycles:>6} cycles {1e9 / (16 * frame_cycles):>7.0f} Hz "
+                      f"{press_ns / 1000:>7.1f} us")
+    dut._log.info(f"manual poll: write to registers in {poll_ns / 1000:.1f} us ({poll_ns / 16:.0f} cycles)")
+    latency.finish()
+    assert await scoreboard.finish() > 0, "No NES frames reached the registers"
+
+@cocotb.test()
+@profile_test
+async def test_nes_clk_div_mid_frame(dut):
+    dut._log.info("Start")
+    tqv = TinyQV(dut, PERIPHERAL_NUM)
+    nes = NES_Controller(dut)
+    clock = Clock(dut.clk, 16, units="ns")
+    cocotb.start_soon(clock.start())
+    cocotb.start_soon(nes.model_nes())
+    await tqv.reset()
+    scoreboard = Scoreboard(dut)
+    await scoreboard.start()
+
+    # Lower the divider while a frame is clocking the buttons in. That frame keeps
+    # the divider it latched with, so no button is skipped, and the next frame
+    # takes the new one.
+    clk_div, interval = NES_POLL_SETTINGS[0]
+    new_clk_div = 8
+    first = NES_Controller.BUTTON_MASKS["A"] | NES_Controller.BUTTON_MASKS["Right"]
+    second = NES_Controller.BUTTON_MASKS["B"] | NES_Controller.BUTTON_MASKS["Left"]
+    await FallingEdge(dut.nes_latch)
+    nes.buttons = first
+    await RisingEdge(dut.nes_latch)
+    start = get_sim_time("ns")
+    await FallingEdge(dut.nes_clk)
+    await tqv.write_reg(NES_CLK_DIV, new_clk_div)
+    nes.buttons = second
+
+    for frame_clk_div, buttons in ((clk_div, first), (new_clk_div, second)):
+        await RisingEdge(dut.nes_latch)
+        frame_cycles = round((get_sim_time("ns") - start) / 16)
+        start = get_sim_time("ns")
+        assert frame_cycles == nes_frame_cycles(frame_clk_div, interval), \
+            f"NES frame of {frame_cycles} cycles for divider {frame_clk_div}"
+        std_btn = dut.test_harness.user_peripheral.std_btn_reg.value.integer
+        assert std_btn == NES_Controller.registers(buttons), \
+            f"std_btn_reg={std_btn:08b} after a frame with divider {frame_clk_div}, expected {NES_Controller.registers(buttons):08b}"
+
+    assert await scoreboard.finish() > 0, "No NES frames reached the registers"
+
+def event_frames(events, first):
+    # Frame numbers of the events counted from the first, the peripheral keeps 4 bits
+    return [(first + event.frame - events[0].frame) % 16 for event in events]
+
+@cocotb.test()
+@profile_test
+async def test_events(dut):
+    dut._log.info("Start")
+    tqv = TinyQV(dut, PERIPHERAL_NUM)
+    nes = NES_Controller(dut)
+    clock = Clock(dut.clk, 16, units="ns")
+    cocotb.start_soon(clock.start())
+    cocotb.start_soon(nes.model_nes())
+    await tqv.reset()
+    scoreboard = Scoreboard(dut)
+    await scoreboard.start()
+
+    # Shorter NES frames, the events do not depend on the polling rate. The frames
+    # after reset change from the reset values, drop their events.
+    await tqv.write_reg(NES_CLK_DIV, 24)
+    await wait_frames(dut, 3)
+    await tqv.drain_events()
+    await tqv.write_reg(STATUS_REG, STATUS_CHANGED | STATUS_OVERFLOW)
+    await wait_frames(dut, 2)
+    assert await tqv.read_reg(STATUS_REG) == 0, "Events without a button change"
+
+    # Every frame that differs from the one before queues an event, drained after
+    # each step of the schedule as firmware would once per frame
+    schedule = ButtonSchedule(NES_Controller, 12, "test_events", hold=(1, 3))
+    frames = list(schedule.frames())
+    expected = [(i % 16, NES_Controller.registers(state)) for i, state in enumerate(frames)
+                if state != (frames[i - 1] if i else 0)]
+    events = []
+    for state, hold in schedule:
+        await nes.run(repeat(state, hold))
+        events += (await tqv.drain_events())[1]
+    await wait_frames(dut, 2)
+    status, last = await tqv.drain_events()
+    events += last
+    assert status & STATUS_CHANGED and not status & STATUS_OVERFLOW, f"status_reg={status:08b} after the schedule"
+    assert [event.ext_btn for event in events] == [0] * len(events)
+    actual = list(zip(event_frames(events, expected[0][0]), [event.std_btn for event in events]))
+    assert actual == expected, f"Events {actual}, expected {expected}"
+
+    # Overflow: a change every frame and nothing drained, the oldest events are kept
+    await tqv.write_reg(STATUS_REG, STATUS_CHANGED)
+    toggle = NES_Controller.BUTTON_MASKS["A"]
+    states = [frames[-1] ^ (toggle if i % 2 == 0 else 0) for i in range(EVENT_DEPTH + 2)]
+    await nes.run(states)
+    await wait_frames(dut, 2)
+    status = await tqv.read_reg(STATUS_REG)
+    assert status == STATUS_CHANGED | STATUS_OVERFLOW | (EVENT_DEPTH << EVENT_COUNT_SHIFT), \
+        f"status_reg={status:08b} after {len(states)} changes"
+
+    # Drain the full FIFO in one burst, within a frame at the reset polling rate
+    start = get_sim_time("ns")
+    status, events = await tqv.drain_events()
+    drain_ns = get_sim_time("ns") - start
+    assert [event.std_btn for event in events] == [NES_Controller.registers(state) for state in states[:EVENT_DEPTH]]
+    assert event_frames(events, 0) == list(range(EVENT_DEPTH)), "Overflowed events are not consecutive frames"
+    assert drain_ns < 16 * nes_frame_cycles(*NES_POLL_SETTINGS[0]), f"Draining {EVENT_DEPTH} events took {drain_ns:.0f} ns"
+    dut._log.info(f"Drained {EVENT_DEPTH} events in {drain_ns:.0f} ns ({drain_ns / 16:.0f} cycles), "
+                  f"{drain_ns / EVENT_DEPTH:.0f} ns per event")
 
+    # The flags stay set until cleared, then the FIFO queues again
+    assert await tqv.read_reg(STATUS_REG) == STATUS_CHANGED | STATUS_OVERFLOW
+    await tqv.write_reg(STATUS_REG, STATUS_CHANGED | STATUS_OVERFLOW)
+    assert await tqv.read_reg(STATUS_REG) == 0, "Sticky flags not cleared"
+    await nes.run([states[-1] ^ toggle])
+    await wait_frames(dut, 2)
+    status, events = await tqv.drain_events()
+    assert status == STATUS_CHANGED | (1 << EVENT_COUNT_SHIFT)
+    assert [event.std_btn for event in events] == [NES_Controller.registers(states[-1] ^ toggle)]
+    assert await scoreboard.finish() > 0, "No NES frames reached the registers"
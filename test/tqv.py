@@ -1,22 +1,83 @@
 # SPDX-FileCopyrightText: © 2025 Michael Bell
 # SPDX-License-Identifier: Apache-2.0
 
+import os
+from collections import namedtuple
+
 from cocotb.triggers import ClockCycles
 from cocotb import logging
 
-from tqv_reg import spi_write_cpha0, spi_read_cpha0
+from tqv_reg import spi_write_cpha0, spi_read_cpha0, spi_burst_cpha0
+from spi_monitor import SpiMonitor
+
+# Trace every SPI register access to this file, see spi_trace.py
+SPI_TRACE = os.environ.get("SPI_TRACE")
+
+# NES polling, see docs/info.md. NES_CTRL bit 0 stops the automatic frames, writing
+# 1 to bit 1 polls one frame. NES_CLK_DIV and NES_INTERVAL set the rate.
+NES_CTRL = 3
+NES_CLK_DIV = 4
+NES_INTERVAL = 5
+NES_MANUAL = 0x01
+NES_POLL = 0x02
+
+# Button change events, see docs/info.md. status_reg flags a changed frame and a
+# lost event (write 1 to clear them) and counts the queued events. EVENT_BUTTONS
+# and EVENT_INFO read the oldest event, any write to EVENT_INFO pops it.
+STATUS_REG = 2
+EVENT_BUTTONS = 6
+EVENT_INFO = 7
+STATUS_SNES = 0x01
+STATUS_CHANGED = 0x02
+STATUS_OVERFLOW = 0x04
+EVENT_COUNT_SHIFT = 4
+EVENT_DEPTH = 4
+
+# frame is the low 4 bits of the peripheral's frame counter
+ButtonEvent = namedtuple("ButtonEvent", ["frame", "std_btn", "ext_btn"])
 
 # This class provides access to the peripheral's registers.
 # This implementation uses the SPI interface embedded in this project,
 # but when the peripheral is added to TinyQV a different implementation
 # is used that reads and writes the registers using Risc-V commands:
 # https://github.com/MichaelBell/ttsky25a-tinyQV/blob/main/test/tqv.py
+#
+# In backdoor mode registers are read and written directly through the
+# hierarchy in zero simulated time. Every spot_check'th backdoor access
+# still goes over SPI and is checked against the backdoor value (0 = never).
+# Both can be set per test, or with TQV_BACKDOOR=1 / TQV_SPOT_CHECK=<n> from make.
+# With SPI_TRACE=<file> a passive monitor records the SPI traffic from reset on,
+# backdoor accesses never reach the bus so they are not in the trace.
 
 class TinyQV:
-    def __init__(self, dut, peripheral_num):
+
+    # Peripheral registers by address, for backdoor access
+    BACKDOOR_REGS = {0: "std_btn_reg", 1: "ext_btn_reg", 2: "status_reg",
+                     3: "nes_ctrl", 4: "nes_clk_div", 5: "nes_interval",
+                     6: "event_buttons", 7: "event_info"}
+
+    # Writes a backdoor deposit cannot reproduce always go over SPI: clearing status
+    # flags, NES_CTRL's poll request (a write of 0 keeps it set) and popping events
+    SPI_WRITES = {STATUS_REG, NES_CTRL, EVENT_INFO}
+
+    # Plain read/write registers, backdoor writes to any other address are dropped
+    # as the peripheral ignores them
+    BACKDOOR_WRITES = {NES_CLK_DIV, NES_INTERVAL}
+
+    def __init__(self, dut, peripheral_num, backdoor=None, spot_check=None):
         self.log = logging.getLogger(f"cocotb.rv-cpu")
         self.log.setLevel("INFO")  # Optional: set log level per class
         self.dut = dut
+        if backdoor is None:
+            backdoor = os.environ.get("TQV_BACKDOOR", "0") not in ("", "0")
+        if spot_check is None:
+            spot_check = int(os.environ.get("TQV_SPOT_CHECK", "0"))
+        self.backdoor = backdoor
+        self.spot_check = spot_check
+        self.backdoor_accesses = 0
+        self.spi_monitor = None
+        if self.backdoor:
+            self.log.info(f"Backdoor register access, SPI spot check every {spot_check} accesses")
 
     # Reset the design, this reset will initialize TinyQV and connect
     # all inputs and outputs to your peripheral.
@@ -29,15 +90,85 @@ class TinyQV:
         await ClockCycles(self.dut.clk, 10)
         self.dut.rst_n.value = 1  
         assert self.dut.uio_oe.value == 0b00001000
+        if SPI_TRACE and self.spi_monitor is None:
+            self.spi_monitor = SpiMonitor(self.dut, SPI_TRACE)
+            self.spi_monitor.start()
 
     # Write a value to a register in your design
     # reg is the address of the register in the range 0-15
     # value is the value to be written, in the range 0-255
     async def write_reg(self, reg, value):
+        if self.backdoor and reg not in self.SPI_WRITES and not self.use_spot_check():
+            self.backdoor_write(reg, value)
+            return
         await spi_write_cpha0(self.dut.clk, self.dut.uio_in, reg, value)
 
     # Read the value of a register from your design
     # reg is the address of the register in the range 0-15
     # The returned value is the data read from the register, in the range 0-255
     async def read_reg(self, reg):
+        if self.backdoor:
+            if not self.use_spot_check():
+                return self.backdoor_read(reg)
+            before = self.backdoor_read(reg)
+            value = await spi_read_cpha0(self.dut.clk, self.dut.uio_in, self.dut.uio_out, reg, 0)
+            after = self.backdoor_read(reg)
+            # The register may legitimately update while the SPI read is in flight
+            assert value in (before, after), \
+                f"Spot check mismatch on reg {reg}: spi={value:08b}, backdoor={before:08b}/{after:08b}"
+            return value
         return await spi_read_cpha0(self.dut.clk, self.dut.uio_in, self.dut.uio_out, reg, 0)
+
+    # Read several registers in one SPI burst
+    # regs is a list of register addresses in the range 0-15
+    # The returned list holds the value read from each register, in the same order
+    async def read_regs(self, regs):
+        if self.backdoor:
+            return [await self.read_reg(reg) for reg in regs]
+        return await spi_burst_cpha0(self.dut.clk, self.dut.uio_in, self.dut.uio_out,
+                                     [(False, reg, 0) for reg in regs])
+
+    # Write several registers in one SPI burst
+    # values is a dict of register address -> value, written in insertion order
+    async def write_regs(self, values):
+        if self.backdoor:
+            for reg, value in values.items():
+                await self.write_reg(reg, value)
+            return
+        await spi_burst_cpha0(self.dut.clk, self.dut.uio_in, self.dut.uio_out,
+                              [(True, reg, value) for reg, value in values.items()])
+
+    # Pop count button change events in one SPI burst, oldest first, as ButtonEvent
+    # Each event is a read of EVENT_BUTTONS and EVENT_INFO and a write to EVENT_INFO
+    async def read_events(self, count):
+        if self.backdoor:
+            values = []
+            for _ in range(count):
+                values += await self.read_regs([EVENT_BUTTONS, EVENT_INFO]) + [0]
+                await self.write_reg(EVENT_INFO, 0)
+        else:
+            values = await spi_burst_cpha0(self.dut.clk, self.dut.uio_in, self.dut.uio_out,
+                                           [(False, EVENT_BUTTONS, 0), (False, EVENT_INFO, 0), (True, EVENT_INFO, 0)] * count)
+        return [ButtonEvent(info >> 4, std_btn, info & 0xF) for std_btn, info in zip(values[0::3], values[1::3])]
+
+    # Read status_reg and pop every event it counts, returns (status, events)
+    async def drain_events(self):
+        status = await self.read_reg(STATUS_REG)
+        return status, await self.read_events((status >> EVENT_COUNT_SHIFT) & 0x7)
+
+    # Count a backdoor access, True if this one should go over SPI instead
+    def use_spot_check(self):
+        self.backdoor_accesses += 1
+        return self.spot_check > 0 and self.backdoor_accesses % self.spot_check == 0
+
+    # Unmapped addresses read as 0 and read-only ones ignore writes, as in the peripheral
+    def backdoor_read(self, reg):
+        name = self.BACKDOOR_REGS.get(reg)
+        if name is None:
+            return 0
+        return getattr(self.dut.test_harness.user_peripheral, name).value.integer
+
+    def backdoor_write(self, reg, value):
+        if reg in self.BACKDOOR_WRITES:
+            name = self.BACKDOOR_REGS[reg]
+            getattr(self.dut.test_harness.user_peripheral, name).value = value
@@ -1,9 +1,13 @@
 # Copyright (c) 2024 Caio Alonso da Costa
 # SPDX-License-Identifier: Apache-2.0
 
+import os
+from functools import lru_cache
+
 import cocotb
 from cocotb.clock import Clock
 from cocotb.triggers import ClockCycles
+from profiling import profiled
 
 def get_bit(value, bit_index):
   temp = value & (1 << bit_index)
@@ -29,14 +33,6 @@ def pull_cs_low(value):
   temp = clear_bit(value, 4)
   return temp
 
-def spi_clk_high(value):
-  temp = set_bit(value, 5)
-  return temp
-
-def spi_clk_low(value):
-  temp = clear_bit(value, 5)
-  return temp
-
 def spi_clk_invert(value):
   temp = xor_bit(value, 5)
   return temp
@@ -52,171 +48,102 @@ def spi_mosi_low(value):
 def spi_miso_read(port):
   return (get_bit (port.value, 3) >> 3)
 
-SPI_HALF_CYCLE_DELAY = 2
-
-async def spi_write_cpha0 (clk, port, address, data):
-
-  temp = port.value
-  result = pull_cs_high(temp)
-  port.value = result
-  await ClockCycles(clk, SPI_HALF_CYCLE_DELAY)
-
-  # Pull CS low + Write command bit - bit 7 - MSBIT in first byte
-  temp = port.value
-  result = pull_cs_low(temp)
-  result2 = spi_mosi_high(result)
-  port.value = result2
-  await ClockCycles(clk, SPI_HALF_CYCLE_DELAY)
-  temp = port.value
-  result = spi_clk_invert(temp)
-  port.value = result
-  await ClockCycles(clk, SPI_HALF_CYCLE_DELAY)
-
-  iterator = 0
-  while iterator < 3:
-    # Don't care - bit 6, bit 5 and bit 4
-    temp = port.value
-    result = spi_clk_invert(temp)
-    result2 = spi_mosi_low(result)
-    port.value = result2
-    await ClockCycles(clk, SPI_HALF_CYCLE_DELAY)
-    temp = port.value
-    result = spi_clk_invert(temp)
-    port.value = result
-    await ClockCycles(clk, SPI_HALF_CYCLE_DELAY)
-    iterator += 1
-
-  iterator = 3
-  while iterator >= 0:
-    # Address[iterator] - bit 3, bit 2, bit 1 and bit 0
-    temp = port.value
-    result = spi_clk_invert(temp)
-    address_bit = get_bit(address, iterator)
-    if (address_bit == 0):
-      result2 = spi_mosi_low(result)
-    else:
-      result2 = spi_mosi_high(result)
-    port.value = result2
-    await ClockCycles(clk, SPI_HALF_CYCLE_DELAY)
-    temp = port.value
-    result = spi_clk_invert(temp)
-    port.value = result
-    await ClockCycles(clk, SPI_HALF_CYCLE_DELAY)
-    iterator -= 1
-
-  iterator = 7
-  while iterator >= 0:
-    # Data[iterator]
-    temp = port.value
-    result = spi_clk_invert(temp)
-    data_bit = get_bit(data, iterator)
-    if (data_bit == 0):
-      result2 = spi_mosi_low(result)
-    else:
-      result2 = spi_mosi_high(result)
-    port.value = result2
-    await ClockCycles(clk, SPI_HALF_CYCLE_DELAY)
-    temp = port.value
-    result = spi_clk_invert(temp)
-    port.value = result
-    await ClockCycles(clk, SPI_HALF_CYCLE_DELAY)
-    iterator -= 1
-
-  temp = port.value
-  result = spi_clk_invert(temp)
-  port.value = result
-  await ClockCycles(clk, SPI_HALF_CYCLE_DELAY)
-
-  temp = port.value
-  result = pull_cs_high(temp)
-  port.value = result
-  await ClockCycles(clk, SPI_HALF_CYCLE_DELAY)  
-
-
-async def spi_read_cpha0 (clk, port_in, port_out, address, data):
-  
-  temp = port_in.value
-  result = pull_cs_high(temp)
-  port_in.value = result
-  await ClockCycles(clk, SPI_HALF_CYCLE_DELAY)
-
-  # Pull CS low + Read command bit - bit 7 - MSBIT in first byte
-  temp = port_in.value
-  result = pull_cs_low(temp)
-  result2 = spi_mosi_low(result)
-  port_in.value = result2
-  await ClockCycles(clk, SPI_HALF_CYCLE_DELAY)
-  temp = port_in.value
-  result = spi_clk_invert(temp)
-  port_in.value = result
-  await ClockCycles(clk, SPI_HALF_CYCLE_DELAY)
-
-  iterator = 0
-  while iterator < 3:
-    # Don't care - bit 6, bit 5 and bit 4
-    temp = port_in.value
-    result = spi_clk_invert(temp)
-    result2 = spi_mosi_low(result)
-    port_in.value = result2
-    await ClockCycles(clk, SPI_HALF_CYCLE_DELAY)
-    temp = port_in.value
-    result = spi_clk_invert(temp)
-    port_in.value = result
-    await ClockCycles(clk, SPI_HALF_CYCLE_DELAY)
-    iterator += 1
-
-  iterator = 3
-  while iterator >= 0:
-    # Address[iterator] - bit 3, bit 2, bit 1 and bit 0
-    temp = port_in.value
-    result = spi_clk_invert(temp)
-    address_bit = get_bit(address, iterator)
-    if (address_bit == 0):
-      result2 = spi_mosi_low(result)
-    else:
-      result2 = spi_mosi_high(result)
-    port_in.value = result2
-    await ClockCycles(clk, SPI_HALF_CYCLE_DELAY)
-    temp = port_in.value
-    result = spi_clk_invert(temp)
-    port_in.value = result
-    await ClockCycles(clk, SPI_HALF_CYCLE_DELAY)
-    iterator -= 1
-
-  miso_byte = 0
-  miso_bit = 0
-
-  # Allow an extra clock here so the read works correctly
-  await ClockCycles(clk, 1)
-
-  iterator = 7
-  while iterator >= 0:
-    # Data[iterator]
-    temp = port_in.value
-    result = spi_clk_invert(temp)
-    data_bit = get_bit(data, iterator)
-    if (data_bit == 0):
-      result2 = spi_mosi_low(result)
-    else:
-      result2 = spi_mosi_high(result)
-    port_in.value = result2
-    await ClockCycles(clk, SPI_HALF_CYCLE_DELAY)
-    temp = port_in.value
-    result = spi_clk_invert(temp)
-    port_in.value = result
-    await ClockCycles(clk, SPI_HALF_CYCLE_DELAY)
-    miso_bit = spi_miso_read(port_out)
-    miso_byte = miso_byte | (miso_bit << iterator)
-    iterator -= 1
-
-  temp = port_in.value
-  result = spi_clk_invert(temp)
-  port_in.value = result
-  await ClockCycles(clk, SPI_HALF_CYCLE_DELAY)
-
-  temp = port_in.value
-  result = pull_cs_high(temp)
-  port_in.value = result
-  await ClockCycles(clk, SPI_HALF_CYCLE_DELAY)
-
-  return miso_byte
+# Number of clk cycles per SPI half cycle, override with SPI_HALF_CYCLE_DELAY=<n> from make
+SPI_HALF_CYCLE_DELAY = int(os.environ.get("SPI_HALF_CYCLE_DELAY", 2))
+
+# A frame is compiled ahead of time into a table of steps, each step is
+# (uio_in value, clk cycles to wait, MISO bit to sample after the wait or -1).
+# The MISO bit is numbered transaction * 8 + bit so bursts can be sampled in one pass.
+@lru_cache(maxsize=1024)
+def spi_compile_cpha0 (base, transactions, half_cycle):
+
+  steps = []
+  value = pull_cs_high(base)
+  steps.append([value, half_cycle, -1])
+
+  for index, (write, address, data) in enumerate(transactions):
+
+    # Command bit - bit 7, then don't care - bit 6, bit 5 and bit 4
+    # Address - bit 3, bit 2, bit 1 and bit 0
+    command_byte = (0x80 if write else 0x00) | (address & 0xF)
+
+    iterator = 7
+    while iterator >= 0:
+      if index == 0 and iterator == 7:
+        # Pull CS low with the first bit of the frame
+        value = pull_cs_low(value)
+      else:
+        value = spi_clk_invert(value)
+      if get_bit(command_byte, iterator) == 0:
+        value = spi_mosi_low(value)
+      else:
+        value = spi_mosi_high(value)
+      steps.append([value, half_cycle, -1])
+      value = spi_clk_invert(value)
+      steps.append([value, half_cycle, -1])
+      iterator -= 1
+
+    if not write:
+      # Allow an extra clock here so the read works correctly
+      steps[-1][1] += 1
+
+    iterator = 7
+    while iterator >= 0:
+      # Data[iterator]
+      value = spi_clk_invert(value)
+      if get_bit(data, iterator) == 0:
+        value = spi_mosi_low(value)
+      else:
+        value = spi_mosi_high(value)
+      steps.append([value, half_cycle, -1])
+      value = spi_clk_invert(value)
+      steps.append([value, half_cycle, -1 if write else index * 8 + iterator])
+      iterator -= 1
+
+  value = spi_clk_invert(value)
+  steps.append([value, half_cycle, -1])
+  value = pull_cs_high(value)
+  steps.append([value, half_cycle, -1])
+
+  return tuple(tuple(step) for step in steps)
+
+# Replay a compiled frame, the only simulator accesses are one write per step
+# and one MISO read per sampled bit
+async def spi_transfer_cpha0 (clk, port_in, port_out, transactions, half_cycle=None):
+
+  if half_cycle is None:
+    half_cycle = SPI_HALF_CYCLE_DELAY
+  transactions = tuple((bool(write), address, data) for (write, address, data) in transactions)
+  steps = spi_compile_cpha0(int(port_in.value), transactions, half_cycle)
+
+  # A frame only waits for half_cycle or half_cycle + 1 clocks, so build one
+  # ClockCycles per wait length for this call and await it on every step
+  waits = {}
+  miso_bytes = [0] * len(transactions)
+  for (value, cycles, sample) in steps:
+    port_in.value = value
+    wait = waits.get(cycles)
+    if wait is None:
+      wait = waits[cycles] = ClockCycles(clk, cycles)
+    await wait
+    if sample >= 0:
+      miso_bytes[sample >> 3] |= spi_miso_read(port_out) << (sample & 7)
+
+  return miso_bytes
+
+@profiled
+async def spi_write_cpha0 (clk, port, address, data, half_cycle=None):
+  await spi_transfer_cpha0(clk, port, None, [(True, address, data)], half_cycle)
+
+@profiled
+async def spi_read_cpha0 (clk, port_in, port_out, address, data, half_cycle=None):
+  miso_bytes = await spi_transfer_cpha0(clk, port_in, port_out, [(False, address, data)], half_cycle)
+  return miso_bytes[0]
+
+# transactions is a list of (write, address, data) tuples, run back-to-back
+# in a single frame - CS is only pulled high before the first and after the last.
+# Requires the spi_reg BURST mode. Returns the data read for every transaction
+# (0 for writes).
+@profiled
+async def spi_burst_cpha0 (clk, port_in, port_out, transactions, half_cycle=None):
+  return await spi_transfer_cpha0(clk, port_in, port_out, transactions, half_cycle)